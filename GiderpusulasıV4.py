@@ -11,16 +11,20 @@ YENİ (v10.9):
 - "Yeni IMEI ekle" kutusu ana iş akışından ayrıldı; "Ara" butonu artık asla yeni IMEI eklemez.
 """
 
-import os, re, io, json, math, threading, csv
+import os, re, io, sys, json, math, time, uuid, queue, hashlib, sqlite3, platform, subprocess, threading, tracemalloc, cProfile, csv
+from collections import Counter, deque
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from datetime import date
-from typing import Any, Dict, List, Optional, Tuple, Set
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Set
 import xml.etree.ElementTree as ET
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from openpyxl import Workbook, load_workbook
-from openpyxl.utils import get_column_letter
+# openpyxl ağır bir modül: ilk pencerenin hızlı açılması için kullanıldığı fonksiyonlarda içe aktarılır
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
@@ -40,21 +44,39 @@ DEFAULTS = {
     "timeout_read": 90,
     "retries": 4,
     "backoff": 0.6,
+    "company_name": "",
+    "token_profiles": [],
+    "queue_db": "",
+    "queue_local_workers": 2,
+    "restore_session": True,
+    "skip_learning": True,          # hiç IMEI çıkarmamış tedarikçilerin XML'ini indirme
+    "skip_min_seen": 5,             # atlamak için en az bu kadar IMEI'siz fatura görülmüş olmalı
+    "skip_verify_rate": 0.05,       # atlanacakların bu oranı yine de indirilip doğrulanır
+    "supplier_never_skip": [],      # asla atlanmayacak VKN/TCKN'ler
+    "fetch_workers": 8,             # eşzamanlı XML indirme sayısı
+    "list_prefetch_pages": 4,       # listelemenin indirme aşamasının önünde tutabileceği sayfa sayısı
+    "plan_confirm": True,           # taramadan önce tahmini maliyeti gösterip onay iste
 }
 DEFAULT_DATE_START = "2015-01-01"
 def _today_str(): return date.today().strftime("%Y-%m-%d")
 
 # ====================== NES API ======================
-EINV_IN_LIST   = "https://api.nes.com.tr/einvoice/v1/incoming/invoices"
-EINV_OUT_LIST  = "https://api.nes.com.tr/einvoice/v1/outgoing/invoices"
-EARCH_OUT_LIST = "https://api.nes.com.tr/earchive/v1/invoices"
+NES_API_BASE   = os.environ.get("NES_API_BASE", "https://api.nes.com.tr").rstrip("/")  # test/mock sunucu için değiştirilebilir
+EINV_IN_LIST   = f"{NES_API_BASE}/einvoice/v1/incoming/invoices"
+EINV_OUT_LIST  = f"{NES_API_BASE}/einvoice/v1/outgoing/invoices"
+EARCH_OUT_LIST = f"{NES_API_BASE}/earchive/v1/invoices"
 
-EINV_IN_DOC    = "https://api.nes.com.tr/einvoice/v1/incoming/invoices/{id}"
-EINV_OUT_DOC   = "https://api.nes.com.tr/einvoice/v1/outgoing/invoices/{id}"
-EARCH_OUT_DOC  = "https://api.nes.com.tr/earchive/v1/invoices/{id}"
+EINV_IN_DOC    = f"{NES_API_BASE}/einvoice/v1/incoming/invoices/{{id}}"
+EINV_OUT_DOC   = f"{NES_API_BASE}/einvoice/v1/outgoing/invoices/{{id}}"
+EARCH_OUT_DOC  = f"{NES_API_BASE}/earchive/v1/invoices/{{id}}"
 
 PAGE_SIZE = 50
 SETTINGS_FILE = "imei_beyanname_v10.json"
+GP_CACHE_DIR  = "gp_cache"
+SESSION_FILE  = "imei_oturum_v10.json"
+SUPPLIER_STATS_FILE = "tedarikci_istatistik.json"
+PLAN_STATS_FILE = "tarama_plan.json"
+REPORT_DB     = "imei_rapor.sqlite"
 
 NS = {
     "inv": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
@@ -99,6 +121,26 @@ def extract_imeis(text: str) -> List[str]:
             out.add(s)
     return sorted(out)
 
+IMEI_RE_BYTES = re.compile(rb'(?<!\d)\d{15}(?!\d)')
+def iter_imeis_from_file(path: str, chunk_size: int = 8 << 20) -> Iterator[str]:
+    """Metin/CSV dosyasını parça parça tarar; geçerli IMEI'leri ilk görülme sırasıyla ve tekil üretir.
+    Bellek dosya boyutuyla değil tekil IMEI sayısıyla büyür (IMEI'ler int olarak saklanır)."""
+    seen: Set[int] = set(); carry = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size); buf = carry + chunk; carry = b""
+            if chunk:
+                # Parça sonundaki rakam dizisi sonraki parçayla birleşebilir → taşınır.
+                # 16 haneden uzun dizi zaten IMEI olamaz; son 16 hanesini taşımak bunu korur.
+                cut = len(buf)
+                while cut and 48 <= buf[cut-1] <= 57: cut -= 1
+                carry = buf[cut:][-16:]; buf = buf[:cut]
+            for m in IMEI_RE_BYTES.finditer(buf):
+                s = m.group(0).decode("ascii"); n = int(s)
+                if n not in seen and _luhn_ok_imei(s):
+                    seen.add(n); yield s
+            if not chunk: break
+
 # ---------- Marka normalizasyonu ----------
 def _cp(p): return re.compile(p, re.I)
 _BRAND_PATTERNS: List[Tuple[str, re.Pattern]] = [
@@ -174,14 +216,21 @@ def headers(token: str, typ="json") -> Dict[str, str]:
     if typ == "bin": h["Accept"]  = "*/*"
     return h
 
-def http_get(url: str, *, token: Optional[str], typ="json", params=None, log=None, stop_evt: Optional[threading.Event]=None):
+# İstek sayısı/süresi türe göre (json=liste, xml, pdf, gp); planlayıcı tahmin ↔ gerçek karşılaştırması için
+HTTP_STATS: Counter = Counter(); _HTTP_STATS_LOCK = threading.Lock()
+def http_stats() -> Counter:
+    with _HTTP_STATS_LOCK: return Counter(HTTP_STATS)
+
+def http_get(url: str, *, token: Optional[str], typ="json", params=None, log=None, stop_evt: Optional[threading.Event]=None, extra_headers: Optional[Dict[str,str]]=None, ok_status: Tuple[int,...]=(200,)):
     if stop_evt is not None and stop_evt.is_set():
         return None
+    t0 = time.perf_counter(); kind = typ if token is not None else "gp"
     try:
         sess = get_session()
         hdrs = headers(token, typ) if token is not None else {"User-Agent": "IMEI-NES-Client/10.9"}
+        if extra_headers: hdrs.update(extra_headers)
         r = sess.get(url, headers=hdrs, params=params, timeout=(TIMEOUT_CONNECT, TIMEOUT_READ))
-        if r.status_code == 200:
+        if r.status_code in ok_status:
             return r
         if log: log(f"[HTTP] Hata {r.status_code}: {url} → {r.text[:300]}")
         return None
@@ -191,6 +240,8 @@ def http_get(url: str, *, token: Optional[str], typ="json", params=None, log=Non
     except requests.RequestException as e:
         if log: log(f"[HTTP] İstek hatası: {e}")
         return None
+    finally:
+        with _HTTP_STATS_LOCK: HTTP_STATS[f"{kind}_n"] += 1; HTTP_STATS[f"{kind}_sn"] += time.perf_counter() - t0
 
 def xfind(t: ET.Element, path: str) -> Optional[ET.Element]: return t.find(path, NS) if t is not None else None
 def xtext(t: ET.Element, path: str) -> str:
@@ -223,6 +274,20 @@ class Parsed:
         self.lines: List[Dict[str,Any]] = []
         self.inv_kdv: Optional[float] = None
         self.text_upper: str = ""
+        # IMEI → ilk geçtiği satır (fiyat/tutar/adet/KDV/marka); tarama döngüleri O(1) erişir
+        self.imei_lines: Dict[str, Dict[str,Any]] = {}
+        self.is_ref: bool = False; self.is_2el: bool = False
+
+    def imei_kdv(self, imei: str) -> Optional[float]:
+        L = self.imei_lines.get(imei)
+        return (L.get("kdv") or self.inv_kdv) if L is not None else self.inv_kdv
+
+    # İş kuyruğu sonuçları için: satır/kalem listeleri birleştirmede kullanılmadığından taşınmaz
+    def to_dict(self) -> Dict[str,Any]:
+        return {k: v for k, v in vars(self).items() if k not in ("lines", "items")}
+    @classmethod
+    def from_dict(cls, d: Dict[str,Any]) -> "Parsed":
+        P = cls(); P.__dict__.update(d); return P
 
 def _line_kdv_percent(line: ET.Element) -> Optional[float]:
     p1 = xfind(line, "cac:TaxTotal/cac:TaxSubtotal/cbc:Percent")
@@ -290,63 +355,184 @@ def parse_invoice_xml(xml_bytes: bytes) -> Parsed:
         if not blob: continue
         kdv = _line_kdv_percent(line)
         if kdv is not None: kdv_seen.append(kdv)
-        P.lines.append({
+        L = {
             "blob": blob, "unit_price": xtext(line, "cac:Price/cbc:PriceAmount"),
             "line_total": xtext(line, "cac:LineExtensionAmount"),
             "qty": xtext(line, "cbc:InvoicedQuantity"), "kdv": kdv
-        })
+        }
+        P.lines.append(L)
         P.items.append(blob)
+        line_imeis = extract_imeis(blob)
+        if line_imeis:
+            L["brand"] = brand_from_text(blob)
+            for im in line_imeis: P.imei_lines.setdefault(im, L)
     P.inv_kdv = _mode_or_first(kdv_seen or _invoice_kdv_candidates(root))
     hay = " \n ".join([P.description] + P.items)
-    P.imeis = extract_imeis(hay)
+    # Satırlar ayrıştırılırken bulunan IMEI'ler + açıklamadakiler (ayraç rakam içermez → tek geçişe eşdeğer)
+    P.imeis = sorted(set(P.imei_lines).union(extract_imeis(P.description)))
     P.brand = brand_from_text(hay)
     P.model = P.lines[0]["blob"] if P.lines else (P.items[0] if P.items else "")
     P.text_upper = nup(hay)
+    P.is_ref = bool(KEY_REF.search(P.text_upper)); P.is_2el = bool(KEY_2EL.search(P.text_upper))
     return P
 
 # ====================== Listeleme / Yardımcılar ======================
-def paged_list(url: str, token: str, start: str, end: str, log, stop_evt, archived: Optional[bool]=None, section_name: str="") -> List[Dict[str,Any]]:
+def list_page(url: str, token: str, start: str, end: str, page: int, log, stop_evt, archived: Optional[bool]=None, section_name: str="", page_size: int=PAGE_SIZE) -> Tuple[Optional[List[Dict[str,Any]]], int]:
+    """Tek liste sayfası → (kayıtlar, toplam kayıt). Hata/durdurmada kayıtlar None döner."""
+    params = {"sort":"createdAt desc", "page":page, "pageSize":page_size}
+    if archived is not None: params["archived"] = "true" if archived else "false"
+    if start: params["startDate"] = f"{start}T00:00:00+03:00"
+    if end:   params["endDate"]   = f"{end}T23:59:59+03:00"
+    r = http_get(url, token=token, typ="json", params=params, log=log, stop_evt=stop_evt)
+    if r is None:
+        log(f"[{section_name}] İstek başarısız/timeout. Döngü sonlandırıldı.")
+        return None, 0
+    try: data = r.json() or {}
+    except ValueError:
+        log(f"[{section_name}] JSON çözümlenemedi."); return None, 0
+    tc = data.get("totalCount") or 0
+    return (data.get("data") or data.get("invoices") or []), (tc if isinstance(tc, int) else 0)
+
+def iter_pages(url: str, token: str, start: str, end: str, log, stop_evt, archived: Optional[bool]=None, section_name: str="") -> Iterator[List[Dict[str,Any]]]:
     if not start and not end:
         start, end = DEFAULT_DATE_START, _today_str()
         log(f"[{section_name}] Tarih boş → {start}..{end} aralığı kullanılacak.")
-    out, page, total = [], 1, None
-    while True:
-        if stop_evt.is_set(): break
-        params = {"sort":"createdAt desc", "page":page, "pageSize":PAGE_SIZE}
-        if archived is not None: params["archived"] = "true" if archived else "false"
-        if start: params["startDate"] = f"{start}T00:00:00+03:00"
-        if end:   params["endDate"]   = f"{end}T23:59:59+03:00"
-        r = http_get(url, token=token, typ="json", params=params, log=log, stop_evt=stop_evt)
-        if r is None:
-            log(f"[{section_name}] İstek başarısız/timeout. Döngü sonlandırıldı.")
-            break
-        try: data = r.json() or {}
-        except ValueError:
-            log(f"[{section_name}] JSON çözümlenemedi."); break
+    page, total = 1, None
+    while not stop_evt.is_set():
+        batch, tc = list_page(url, token, start, end, page, log, stop_evt, archived, section_name)
+        if batch is None: return
         if total is None:
-            tc = data.get("totalCount") or 0
-            total = max(1, math.ceil(tc / PAGE_SIZE)) if isinstance(tc, int) else 1
-        batch = data.get("data") or data.get("invoices") or []
-        if not batch: break
+            total = max(1, math.ceil(tc / PAGE_SIZE))
+        if not batch: return
         log(f"[{section_name}] Sayfa {page}/{total} → {len(batch)} kayıt")
-        out.extend(batch)
-        if page >= total: break
+        yield batch
+        if page >= total: return
         page += 1
+
+def paged_list(url: str, token: str, start: str, end: str, log, stop_evt, archived: Optional[bool]=None, section_name: str="") -> List[Dict[str,Any]]:
+    return [m for batch in iter_pages(url, token, start, end, log, stop_evt, archived, section_name) for m in batch]
+
+def iter_both_archived(url: str, token: str, start: str, end: str, log, stop_evt, section_name: str, prefetch: int=4) -> Iterator[Dict[str,Any]]:
+    """Arşivsiz+arşivli listeyi arka planda sayfa sayfa çeker; kayıtlar sınırlı kuyruktan id'ye göre tekilleştirilerek akar."""
+    pages: "queue.Queue" = queue.Queue(maxsize=max(1, prefetch)); quit_evt = threading.Event(); END = object()
+    def put(x) -> bool:
+        while not quit_evt.is_set():
+            try: pages.put(x, timeout=0.2); return True
+            except queue.Full: pass
+        return False
+    def produce():
+        try:
+            for archived, label in ((False, "Arşivsiz"), (True, "Arşivli")):
+                log(f"[{section_name}] {label} çekiliyor...")
+                for batch in iter_pages(url, token, start, end, log, stop_evt, archived, section_name):
+                    if not put(batch): return
+        except Exception as e: log(f"[{section_name}] Listeleme hatası: {e}")
+        finally: put(END)
+    threading.Thread(target=produce, daemon=True, name=f"list-{section_name}").start()
+    seen: Set[str] = set()
+    try:
+        while (batch := pages.get()) is not END:
+            for m in batch:
+                mid = str(m.get("id") or "")
+                if mid and mid not in seen:
+                    seen.add(mid); yield m
+        log(f"[{section_name}] Birleştirildi (tekil): {len(seen)} kayıt")
+    finally: quit_evt.set()
+
+def pipeline_map(fn, items, workers: int, stop_evt, inflight: int=0) -> Iterator[Tuple[Any, Any]]:
+    """items'ı akarken iş parçacıklarında işler; uçuştaki iş sayısı sınırlı, sonuçlar giriş sırasıyla (öğe, sonuç)."""
+    pend: deque = deque(); limit = max(1, inflight or workers * 2)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        try:
+            for it in items:
+                if stop_evt.is_set(): break
+                pend.append((it, ex.submit(fn, it)))
+                while pend and (len(pend) >= limit or pend[0][1].done()):
+                    it0, f = pend.popleft(); yield it0, f.result()
+            while pend and not stop_evt.is_set():
+                it0, f = pend.popleft(); yield it0, f.result()
+        finally:
+            for _, f in pend: f.cancel()
+
+def batched(items, n: int) -> Iterator[List[Any]]:
+    buf = []
+    for it in items:
+        buf.append(it)
+        if len(buf) >= n: yield buf; buf = []
+    if buf: yield buf
+
+# ---------- EAR/EFR belge numarasıyla hedefli arama ----------
+# Belge no = 3 harf seri + 4 hane yıl + 9 hane sıra. Liste createdAt'e göre azalan sıralı olduğundan
+# aynı serideki sıra numaraları sayfalar boyunca azalır → yıl aralığında sayfa üzerinde ikili arama.
+def _docno_parts(docno: str) -> Tuple[str, int, int]:
+    d = docno.upper(); return d[:3], int(d[3:7]), int(d[7:])
+
+def _bisect_docnos(url: str, token: str, targets: Set[str], start: str, end: str, archived: bool, log, stop_evt, section_name: str) -> Tuple[Dict[str,Dict[str,Any]], Set[str]]:
+    """(bulunanlar, yönlendirilemeyenler). Sayfada aynı seriden belge yoksa arama yönü bilinemez."""
+    pages: Dict[int, List[Dict[str,Any]]] = {}; found: Dict[str,Dict[str,Any]] = {}; unsure: Set[str] = set(); total = [1]
+    def get(pg: int) -> Optional[List[Dict[str,Any]]]:
+        if pg not in pages:
+            batch, tc = list_page(url, token, start, end, pg, log, stop_evt, archived, section_name)
+            if batch is None: return None
+            pages[pg] = batch
+            if pg == 1: total[0] = max(1, math.ceil(tc / PAGE_SIZE))
+            for m in batch:
+                dn = str(m.get("documentNumber") or "").upper()
+                if dn in targets: found.setdefault(dn, m)
+        return pages[pg]
+    if get(1) is None or not pages[1]: return found, set()
+    for dn in sorted(targets):
+        if dn in found or stop_evt.is_set(): continue
+        pfx, _, seq = _docno_parts(dn); lo, hi = 1, total[0]
+        while lo <= hi and dn not in found:
+            mid = (lo + hi) // 2; batch = get(mid)
+            if batch is None: return found, unsure
+            if dn in found: break
+            seqs = [_docno_parts(x)[2] for x in (str(m.get("documentNumber") or "").upper() for m in batch) if DOCNO_RE.fullmatch(x) and x[:3] == pfx]
+            if not seqs: unsure.add(dn); break
+            if seq > max(seqs): hi = mid - 1
+            elif seq < min(seqs): lo = mid + 1
+            else: break
+    return found, unsure
+
+def locate_docnos(url: str, token: str, docnos: Set[str], start: str, end: str, log, stop_evt, section_name: str) -> Dict[str,Dict[str,Any]]:
+    start = start or DEFAULT_DATE_START; end = end or _today_str()
+    by_year: Dict[int, Set[str]] = {}
+    for dn in docnos: by_year.setdefault(_docno_parts(dn)[1], set()).add(dn)
+    def one_year(year: int, nums: Set[str]) -> Dict[str,Dict[str,Any]]:
+        # Yıl sonu belgeleri ertesi ay sisteme düşebilir → aralık bir ay taşırılır
+        ys = max(start, f"{year}-01-01"); ye = min(end, f"{year+1}-01-31")
+        if ys > ye: return {}
+        found: Dict[str,Dict[str,Any]] = {}; unsure: Set[str] = set()
+        for archived in (False, True):
+            f, u = _bisect_docnos(url, token, nums - found.keys(), ys, ye, archived, log, stop_evt, section_name)
+            found.update(f); unsure |= u
+        unsure -= found.keys()
+        if unsure:
+            log(f"[{section_name}] {year}: {len(unsure)} belge için sıra ile yön bulunamadı → yıl aralığı taranıyor.")
+            for archived in (False, True):
+                for m in paged_list(url, token, ys, ye, log, stop_evt, archived=archived, section_name=section_name):
+                    dn = str(m.get("documentNumber") or "").upper()
+                    if dn in unsure: found.setdefault(dn, m)
+        return found
+    out: Dict[str,Dict[str,Any]] = {}
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(by_year)))) as ex:
+        for res in ex.map(lambda kv: one_year(*kv), sorted(by_year.items())): out.update(res)
     return out
 
-def list_both_archived(url: str, token: str, start: str, end: str, log, stop_evt, section_name: str) -> List[Dict[str,Any]]:
-    items = []
-    log(f"[{section_name}] Arşivsiz çekiliyor...")
-    items += paged_list(url, token, start, end, log, stop_evt, archived=False, section_name=section_name)
-    log(f"[{section_name}] Arşivli çekiliyor...")
-    items += paged_list(url, token, start, end, log, stop_evt, archived=True,  section_name=section_name)
-    seen, uniq = set(), []
-    for m in items:
-        mid = str(m.get("id") or "")
-        if mid and mid not in seen:
-            seen.add(mid); uniq.append(m)
-    log(f"[{section_name}] Birleştirildi (tekil): {len(uniq)} kayıt")
-    return uniq
+def locate_sales_docnos(token: str, docnos: Set[str], start: str, end: str, log, stop_evt, pfx: str="") -> Dict[str, List[Dict[str,Any]]]:
+    """EAR → önce e-Arşiv, diğerleri → önce Giden e-Fatura; bulunamayanlar diğer uçta aranır."""
+    ends = {"arch": (EARCH_OUT_LIST, f"{pfx}SATIŞ-eArşiv"), "out": (EINV_OUT_LIST, f"{pfx}SATIŞ-Giden")}
+    res: Dict[str, List[Dict[str,Any]]] = {"arch": [], "out": []}; left = {d.upper() for d in docnos}
+    for phase in (0, 1):
+        for key, (url, sec) in ends.items():
+            want = {d for d in left if (d.startswith("EAR") == (key == "arch")) != bool(phase)}
+            if not want or stop_evt.is_set(): continue
+            hit = locate_docnos(url, token, want, start, end, log, stop_evt, sec)
+            res[key].extend(hit.values()); left -= hit.keys()
+    found = len(docnos) - len(left)
+    log(f"[{pfx}SATIŞ] Hedefli arama: {found}/{len(docnos)} belge bulundu." + (f" Bulunamayan: {', '.join(sorted(left)[:10])}{' …' if len(left) > 10 else ''}" if left else ""))
+    return res
 
 def fetch_xml_by(url_tpl: str, token: str, inv_id: str) -> Optional[bytes]:
     r = http_get(f"{url_tpl.format(id=inv_id)}/xml", token=token, typ="xml")
@@ -363,7 +549,8 @@ HEADERS = [
     "SATIŞ TARİHi","ALICI ADI SOYADI","SATIŞ BEDELİ","KDV TUTARI","SATIŞ BELGESİNİN NUMARASI",
     "ALICI KİMLİK TÜRÜ","ALICI KİMLİK NO",
     "Sütun1","ALIŞ BELGELERİ TÜRÜ","DURUMU",
-    "ALIŞ KDV","SATIŞ KDV","SINIF","GEREKÇE"
+    "ALIŞ KDV","SATIŞ KDV","SINIF","GEREKÇE",
+    "FİRMA"
 ]
 def ensure_len(vals: List[Any]) -> List[Any]:
     if len(vals) < len(HEADERS):
@@ -387,15 +574,88 @@ def save_settings(s: Dict[str,Any]):
     s2 = {k:v for k,v in s.items() if k != "_whitelist_compiled"}
     with open(SETTINGS_FILE, "w", encoding="utf-8") as f: json.dump(s2, f, ensure_ascii=False, indent=2)
 
-def write_excel(rows: List[List[Any]], out_path: str):
+# ---------- Rapor özeti (artımlı toplamlar) ----------
+SUMMARY_DIMS: Tuple[Tuple[str, Optional[int]], ...] = (("Marka", 8), ("SINIF", 22), ("DURUMU", 19), ("Kaynak", 1), ("Ay", None))
+SUMMARY_HEADERS = ["Boyut", "Değer", "Adet", "Alış Toplamı", "Satış Toplamı"]
+_MONTH_ISO = re.compile(r"(\d{4})-(\d{1,2})"); _MONTH_TR = re.compile(r"\b\d{1,2}[./](\d{1,2})[./](\d{4})\b")
+
+def amount_kurus(v: Any) -> int:
+    """'1.234,56' / '1234.56' / 1234.56 → kuruş (tam sayı; ekle/çıkar toplamları kaymasın diye)."""
+    if isinstance(v, (int, float)): return int(round(v * 100))
+    t = re.sub(r"[^\d,.\-]", "", str(v or ""))
+    if not t: return 0
+    if "," in t and "." in t: t = t.replace(".", "").replace(",", ".") if t.rfind(",") > t.rfind(".") else t.replace(",", "")
+    elif "," in t: t = t.replace(",", ".")
+    elif t.count(".") > 1: t = t.replace(".", "")
+    try: return int(round(float(t) * 100))
+    except ValueError: return 0
+
+def month_key(vals: List[Any]) -> str:
+    for v in (vals[4], vals[10]): # önce alış, yoksa satış tarihi
+        v = str(v or "")
+        if (m := _MONTH_ISO.search(v)): return f"{m.group(1)}-{int(m.group(2)):02d}"
+        if (m := _MONTH_TR.search(v)): return f"{m.group(2)}-{int(m.group(1)):02d}"
+    return ""
+
+class ReportSummary:
+    """Marka/SINIF/DURUMU/Kaynak/Ay bazında adet + alış/satış toplamı; satırlar eklenip değiştikçe güncellenir."""
+    def __init__(self, data: Optional[Dict[str, Dict[str, List[int]]]] = None):
+        self.lock = threading.Lock(); self.data = data or {}
+        for dim in ("TOPLAM",) + tuple(d for d, _ in SUMMARY_DIMS): self.data.setdefault(dim, {})
+    def reset(self):
+        with self.lock:
+            for b in self.data.values(): b.clear()
+    def _apply(self, vals: List[Any], sign: int):
+        vals = ensure_len(vals); buy = amount_kurus(vals[7]); sell = amount_kurus(vals[12])
+        keys = [("TOPLAM", "")] + [(dim, month_key(vals) if col is None else str(vals[col] or "").strip()) for dim, col in SUMMARY_DIMS]
+        with self.lock:
+            for dim, k in keys:
+                b = self.data[dim]; a = b.get(k)
+                if a is None: a = b[k] = [0, 0, 0]
+                a[0] += sign; a[1] += sign * buy; a[2] += sign * sell
+                if not a[0]: del b[k]
+    def add(self, vals: List[Any]): self._apply(vals, 1)
+    def remove(self, vals: List[Any]): self._apply(vals, -1)
+    def replace(self, old: List[Any], new: List[Any]):
+        if old is not None: self._apply(old, -1)
+        self._apply(new, 1)
+    def state(self) -> Dict[str, Dict[str, List[int]]]:
+        with self.lock: return {dim: {k: list(a) for k, a in b.items()} for dim, b in self.data.items()}
+    def table(self) -> List[List[Any]]:
+        out = []
+        for dim, b in self.state().items():
+            for k, (n, buy, sell) in sorted(b.items(), key=lambda kv: (kv[0] if dim == "Ay" else -kv[1][0], kv[0])):
+                out.append([dim, k or ("" if dim == "TOPLAM" else "(boş)"), n, buy / 100, sell / 100])
+        return out
+
+def write_excel(rows: List[List[Any]], out_path: str, summary: Optional[ReportSummary] = None):
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
     wb = Workbook(); ws = wb.active; ws.title = "IMEI_RAPOR"
     ws.append(HEADERS)
     for r in rows: ws.append(ensure_len(r))
     for col in range(1, len(HEADERS)+1):
         mx = max((len(str(ws.cell(row=i, column=col).value or "")) for i in range(1, ws.max_row+1)), default=12)
         ws.column_dimensions[get_column_letter(col)].width = min(max(12, mx+2), 60)
+    if summary is not None:
+        wo = wb.create_sheet("OZET"); wo.append(SUMMARY_HEADERS)
+        for r in summary.table(): wo.append(r)
+        for col, w in zip("ABCDE", (10, 32, 10, 16, 16)): wo.column_dimensions[col].width = w
+        for c in ("D", "E"):
+            for cell in wo[c][1:]: cell.number_format = "#,##0.00"
     wb.save(out_path)
 
+# ---------- Oturum anlık görüntüsü (hızlı açılış) ----------
+# Düz JSON: çalışma klasöründeki dosya kod çalıştıramaz; kümeler liste olarak yazılır.
+def save_session_snapshot(state: Dict[str,Any], path: str = SESSION_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: f.write(json.dumps(state, ensure_ascii=False, separators=(",", ":"))) # tek seferde C kodlayıcı
+    os.replace(tmp, path)
+
+def load_session_snapshot(path: str = SESSION_FILE) -> Optional[Dict[str,Any]]:
+    st = _read_json(path) if os.path.exists(path) else None
+    return st if isinstance(st, dict) else None
+
 def is_whitelisted_supplier(name: str, settings: Dict[str,Any]) -> bool:
     if not name: return False
     U = nup(name)
@@ -417,10 +677,13 @@ _HEADER_ALIAS = {
     "alici kimlik turu": "ALICI KİMLİK TÜRÜ", "alici kimlik no": "ALICI KİMLİK NO",
     "sutun1": "Sütun1", "şube": "Sütun1", "sube": "Sütun1", "magaza":"Sütun1",
     "alis belgeleri turu": "ALIŞ BELGELERİ TÜRÜ", "durumu": "DURUMU",
+    "firma": "FİRMA", "sirket": "FİRMA",
 }
 def _build_header_map(ws) -> Optional[Dict[str, Any]]:
-    for r in range(1, min(11, ws.max_row)+1):
-        row = [ws.cell(row=r, column=c).value for c in range(1, ws.max_column+1)]
+    return _header_map_from_rows(ws.iter_rows(min_row=1, max_row=min(11, ws.max_row), values_only=True))
+def _header_map_from_rows(rows) -> Optional[Dict[str, Any]]:
+    for r, row in enumerate(rows, 1):
+        row = list(row)
         normed = [_norm_header(x) for x in row]
         col_to_name = {}; hit = 0; has_imei = False
         for idx, hh in enumerate(normed):
@@ -432,18 +695,22 @@ def _build_header_map(ws) -> Optional[Dict[str, Any]]:
                 if name == "imei": has_imei = True
         if has_imei and hit >= 5: return {"row": r, "cols": col_to_name}
     return None
+# GP/Excel metin hücrelerinde '12.500' binlik ayraçlıdır (XML tutarlarında nokta hep ondalık); okurken düzeltilir
+_THOUSANDS_DOT = re.compile(r"-?[1-9]\d{0,2}(\.\d{3})+")
+def gp_amount(v: Any) -> str:
+    t = norm(v)
+    return t.replace(".", "") if _THOUSANDS_DOT.fullmatch(t) else t
 def parse_gp_template_workbook(wb, log) -> List[List[Any]]:
     out_rows: List[List[Any]] = []
     for ws in wb.worksheets:
         hm = _build_header_map(ws)
         if not hm: continue
         hdr_row = hm["row"]; colmap = hm["cols"]; taken = 0
-        for r in range(hdr_row+1, ws.max_row+1):
-            vals = [ws.cell(row=r, column=c).value for c in range(1, ws.max_column+1)]
+        for vals in ws.iter_rows(min_row=hdr_row+1, values_only=True):
             if not any(norm(v) for v in vals): continue
             row_dict = {name: "" for name in HEADERS}
             for cidx, name in colmap.items():
-                if cidx < len(vals): row_dict[name] = norm(vals[cidx])
+                if cidx < len(vals): row_dict[name] = gp_amount(vals[cidx]) if name in ("Borç Tutar", "SATIŞ BEDELİ") else norm(vals[cidx])
             imei_val = row_dict.get("imei", "")
             if not re.fullmatch(r"\d{15}", imei_val or ""):
                 merged = " | ".join([norm(v) for v in vals])
@@ -471,8 +738,7 @@ def _find_col_idx(headers_row: List[Any], keys: List[str]) -> Optional[int]:
             if k in hh: return i
     return None
 def _scan_header(ws) -> Tuple[int, Dict[str,int]]:
-    for r in range(1, min(12, ws.max_row)+1):
-        row = [ws.cell(row=r, column=c).value for c in range(1, ws.max_column+1)]
+    for r, row in enumerate(ws.iter_rows(min_row=1, max_row=min(12, ws.max_row), values_only=True), 1):
         idx_imei = _find_col_idx(row, GP_KW["imei"])
         if idx_imei is not None:
             cols = { "imei": idx_imei, "tarih": _find_col_idx(row, GP_KW["tarih"]) or -1, "bedel": _find_col_idx(row, GP_KW["bedel"]) or -1, "ad": _find_col_idx(row, GP_KW["ad"]) or -1, "sube": _find_col_idx(row, GP_KW["sube"]) or -1, "aciklama": _find_col_idx(row, GP_KW["aciklama"]) or -1, }
@@ -483,8 +749,7 @@ def parse_gp_workbook(wb, log) -> List[Dict[str,Any]]:
     for ws in wb.worksheets:
         head_row, cols = _scan_header(ws)
         start = head_row + 1; found_rows = 0
-        for r in range(start, ws.max_row+1):
-            vals = [ws.cell(row=r, column=c).value for c in range(1, ws.max_column+1)]
+        for vals in ws.iter_rows(min_row=start, values_only=True):
             text_row = " | ".join([norm(v) for v in vals])
             imeis = extract_imeis(text_row)
             if not imeis and cols["imei"] >= 0:
@@ -492,11 +757,466 @@ def parse_gp_workbook(wb, log) -> List[Dict[str,Any]]:
                 if re.fullmatch(r"\d{15}", v) and _luhn_ok_imei(v): imeis = [v]
             if not imeis: continue
             for im in imeis:
-                item = { "imei": im, "tarih": norm(vals[cols["tarih"]]) if cols["tarih"] >= 0 else "", "bedel": norm(vals[cols["bedel"]]) if cols["bedel"] >= 0 else "", "ad": norm(vals[cols["ad"]]) if cols["ad"] >= 0 else "", "sube": norm(vals[cols["sube"]]) if cols["sube"] >= 0 else "", "aciklama": norm(vals[cols["aciklama"]]) if cols["aciklama"] >= 0 else "", }
+                item = { "imei": im, "tarih": norm(vals[cols["tarih"]]) if cols["tarih"] >= 0 else "", "bedel": gp_amount(vals[cols["bedel"]]) if cols["bedel"] >= 0 else "", "ad": norm(vals[cols["ad"]]) if cols["ad"] >= 0 else "", "sube": norm(vals[cols["sube"]]) if cols["sube"] >= 0 else "", "aciklama": norm(vals[cols["aciklama"]]) if cols["aciklama"] >= 0 else "", }
                 out.append(item); found_rows += 1
         log(f"[GP] Sayfa '{ws.title}': {found_rows} satır/IMEI çıkarıldı.")
     return out
 
+# ---------- GP önbelleği (koşullu GET + içerik özetine göre ayrıştırma sonucu) ----------
+# Şablon satırları HEADERS sırasıyla saklanır: sütunlar ya da ayrıştırıcılar değişince sürümü artırın,
+# eski sonuçlar (aynı çalışma kitabı için bile) yeniden ayrıştırılır.
+GP_PARSER_VERSION = 2
+GP_PARSE_SCHEMA = hashlib.sha1(f"{GP_PARSER_VERSION}|{'|'.join(HEADERS)}".encode("utf-8")).hexdigest()[:10]
+def _gp_cache_file(name: str) -> str:
+    try: os.makedirs(GP_CACHE_DIR, exist_ok=True)
+    except OSError: pass  # yazma adımları hatayı kendisi raporlar; önbelleksiz devam edilir
+    return os.path.join(GP_CACHE_DIR, name)
+def _gp_parsed_file(sha: str) -> str: return _gp_cache_file(f"parsed_{GP_PARSE_SCHEMA}_{sha}.json")
+def _read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError): return None
+def _write_json(path: str, obj: Any):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def fetch_gp_cached(url: str, log, stop_evt: Optional[threading.Event]=None) -> Optional[Tuple[bytes, str]]:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    meta_p, body_p = _gp_cache_file(key + ".json"), _gp_cache_file(key + ".bin")
+    meta = _read_json(meta_p) if os.path.exists(body_p) else None
+    cond = {}
+    if meta:
+        if meta.get("etag"): cond["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): cond["If-Modified-Since"] = meta["last_modified"]
+    r = http_get(url, token=None, typ="bin", log=log, stop_evt=stop_evt, extra_headers=cond, ok_status=(200, 304))
+    if r is None:
+        if not meta: return None
+        log(f"[GP] İndirilemedi, önbellekteki kopya kullanılıyor: {url}")
+        r_status = 304
+    else: r_status = r.status_code
+    if r_status == 304:
+        with open(body_p, "rb") as f: content = f.read()
+        if r is not None: log(f"[GP] Değişmemiş (304): {url}")
+        return content, meta["sha256"]
+    content = r.content; sha = hashlib.sha256(content).hexdigest()
+    if meta and meta.get("sha256") != sha:
+        try: os.remove(_gp_parsed_file(meta["sha256"]))
+        except OSError: pass
+    try:
+        with open(body_p + ".tmp", "wb") as f: f.write(content)
+        os.replace(body_p + ".tmp", body_p)
+        _write_json(meta_p, {"url": url, "etag": r.headers.get("ETag", ""), "last_modified": r.headers.get("Last-Modified", ""), "sha256": sha})
+    except OSError as e:
+        log(f"[GP] Önbellek yazılamadı ({url}): {e}")
+        try: os.remove(meta_p)  # eski meta yeni gövdeyle eşleşmeyebilir; koşullu GET'i devre dışı bırak
+        except OSError: pass
+    return content, sha
+
+def gp_cache_lookup(sha: str, want_template: bool) -> Optional[Tuple[List[List[Any]], List[Dict[str,Any]]]]:
+    cached = _read_json(_gp_parsed_file(sha)) or {}
+    if want_template and "template" in cached:
+        if cached["template"]: return cached["template"], []
+        if "items" in cached: return [], cached["items"]
+    elif not want_template and "items" in cached: return [], cached["items"]
+    return None
+
+def gp_cache_store(sha: str, want_template: bool, rows: List[List[Any]], items: List[Dict[str,Any]], log):
+    path = _gp_parsed_file(sha); cached = _read_json(path) or {}
+    if want_template: cached["template"] = rows
+    if not rows: cached["items"] = items
+    try: _write_json(path, cached)
+    except OSError as e: log(f"[GP] Önbellek yazılamadı: {e}")
+
+def parse_gp_bytes(content: bytes, want_template: bool=True) -> Tuple[List[List[Any]], List[Dict[str,Any]], List[str]]:
+    """Süreç havuzunda çalışır: (şablon satırları, serbest GP kayıtları, log satırları)."""
+    from openpyxl import load_workbook
+    logs: List[str] = []
+    wb = load_workbook(io.BytesIO(content), data_only=True)
+    rows = parse_gp_template_workbook(wb, logs.append) if want_template else []
+    items = [] if rows else parse_gp_workbook(wb, logs.append)
+    return rows, items, logs
+
+def load_gp_sources(urls: List[str], log, stop_evt: Optional[threading.Event]=None, want_template: bool=True) -> List[Tuple[str, List[List[Any]], List[Dict[str,Any]]]]:
+    """Tüm URL'ler eşzamanlı indirilir, önbellekte olmayan çalışma kitapları süreç havuzunda ayrıştırılır.
+    Sonuç URL sırasıyla döner; aynı içerik (özet) birden çok URL'de varsa bir kez ayrıştırılır."""
+    if not urls: return []
+    def fetch_one(u: str) -> Optional[Tuple[bytes, str]]:
+        try: return fetch_gp_cached(u, log, stop_evt)
+        except Exception as e: log(f"  ❌ GP URL indirilemedi ({u}): {e}"); return None
+    with ThreadPoolExecutor(max_workers=min(8, len(urls))) as ex:
+        fetched = list(ex.map(fetch_one, urls))
+    parsed: Dict[str, Tuple[List[List[Any]], List[Dict[str,Any]]]] = {}; todo: Dict[str, bytes] = {}
+    for url, got in zip(urls, fetched):
+        if got is None: log(f"  ❌ GP URL yüklenemedi: {url}"); continue
+        if got[1] in parsed or got[1] in todo: continue
+        hit = gp_cache_lookup(got[1], want_template)
+        if hit is not None: parsed[got[1]] = hit; log(f"[GP] Önbellekten: {len(hit[0]) or len(hit[1])} kayıt ({got[1][:8]})")
+        else: todo[got[1]] = got[0]
+    if todo:
+        log(f"[GP] {len(todo)} çalışma kitabı paralel ayrıştırılıyor...")
+        try: pool = ProcessPoolExecutor(max_workers=min(len(todo), os.cpu_count() or 1)) if len(todo) > 1 else None
+        except (OSError, NotImplementedError): pool = None
+        try:
+            futs = {sha: (pool.submit(parse_gp_bytes, content, want_template) if pool else None) for sha, content in todo.items()}
+            for sha, fut in futs.items():
+                try: rows, items, logs = fut.result() if fut else parse_gp_bytes(todo[sha], want_template)
+                except Exception as e: log(f"  ❌ GP çalışma kitabı işlenemedi ({sha[:8]}): {e}"); continue
+                for m in logs: log(m)
+                gp_cache_store(sha, want_template, rows, items, log); parsed[sha] = (rows, items)
+        finally:
+            if pool: pool.shutdown()
+    return [(url, *parsed[got[1]]) for url, got in zip(urls, fetched) if got is not None and got[1] in parsed]
+
+# ---------- Öğrenilmiş tedarikçi atlama listesi ----------
+# Liste kaydında gönderen VKN/TCKN alanı farklı adlarla gelebildiği için birkaç aday anahtar denenir.
+_META_PARTY_KEYS = ("senderVknTckn", "supplierVknTckn", "accountingSupplierPartyVknTckn", "senderRegisterNumber", "registerNumber", "vknTckn")
+def meta_supplier_id(meta: Dict[str,Any]) -> str:
+    for k in _META_PARTY_KEYS:
+        v = meta.get(k)
+        if v: return norm(v)
+    for k in ("sender", "supplier", "accountingSupplierParty"):
+        sub = meta.get(k)
+        if isinstance(sub, dict):
+            for kk in ("vknTckn", "registerNumber", "identifier", "id"):
+                if sub.get(kk): return norm(sub[kk])
+    return ""
+
+class SupplierStats:
+    # seen/imei tekil fatura id'si başına sayılır; aynı aralığı yeniden taramak tedarikçiyi "IMEI'siz" yapmaz.
+    # id'ler yalnızca henüz işe yaramamış (atlanabilecek) tedarikçiler için ve en fazla IDS_MAX tane (en yeniler) tutulur;
+    # işe yarayan tedarikçi hiç atlanmayacağı için kümesi bırakılır, dosya ve açılış süresi sınırsız büyümez.
+    IDS_MAX = 1000
+    def __init__(self, path: str = SUPPLIER_STATS_FILE):
+        self.path = path; self.lock = threading.Lock()
+        self.data: Dict[str, Dict[str,Any]] = _read_json(path) or {}
+        self.ids: Dict[str, Dict[str, None]] = {} # sıralı küme (eklenme sırası → en eskiler önce atılır)
+        for sid, st in self.data.items():
+            if "ids" not in st and not st.get("imei"): st["seen"] = st["imei"] = 0 # eski biçim tekrarları ayırt edemez → yeniden öğrenilir
+            ids = st.pop("ids", [])
+            if not st["imei"]: self.ids[sid] = dict.fromkeys(ids[-self.IDS_MAX:])
+    def record(self, supplier_id: str, name: str, inv_id: str, useful: bool):
+        """useful: fatura rapora satır üretti (IMEI, YENİLENMİŞ ürün ya da yenileme hizmeti)."""
+        if not supplier_id or not inv_id: return
+        with self.lock:
+            st = self.data.setdefault(supplier_id, {"name": name, "seen": 0, "imei": 0, "last": ""})
+            if name: st["name"] = name
+            st["last"] = _today_str()
+            if st["imei"]: st["seen"] += 1; st["imei"] += int(useful); return
+            ids = self.ids.setdefault(supplier_id, {})
+            if inv_id in ids: return
+            st["seen"] += 1; st["imei"] += int(useful)
+            if useful: self.ids.pop(supplier_id, None); return
+            ids[inv_id] = None
+            if len(ids) > self.IDS_MAX: del ids[next(iter(ids))]
+    def should_skip(self, supplier_id: str, inv_id: str, settings: Dict[str,Any]) -> bool:
+        if not supplier_id or not settings.get("skip_learning", True) or supplier_id in settings.get("supplier_never_skip", []): return False
+        st = self.data.get(supplier_id)
+        if not st or st["imei"] > 0 or st["seen"] < int(settings.get("skip_min_seen", 5)): return False
+        # Belirli bir örnek yine indirilir; tedarikçi cihaz satmaya başlarsa istatistik bunu öğrenir
+        sample = int(hashlib.md5(inv_id.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return sample >= float(settings.get("skip_verify_rate", 0.05))
+    def skip_rate(self, settings: Dict[str,Any]) -> float:
+        """Geçmişte görülen alış faturalarının atlanacak tedarikçilere düşen payı (doğrulama örneği hariç)."""
+        if not settings.get("skip_learning", True): return 0.0
+        never = set(settings.get("supplier_never_skip", [])); min_seen = int(settings.get("skip_min_seen", 5))
+        with self.lock:
+            total = sum(st["seen"] for st in self.data.values())
+            skip = sum(st["seen"] for sid, st in self.data.items() if st["imei"] == 0 and st["seen"] >= min_seen and sid not in never)
+        return skip / total * (1 - float(settings.get("skip_verify_rate", 0.05))) if total else 0.0
+    def save(self):
+        with self.lock: _write_json(self.path, {sid: dict(st, ids=list(self.ids[sid])) if sid in self.ids else st for sid, st in self.data.items()})
+
+# ====================== Tarama Planlayıcı ======================
+# Her liste ucunun ilk sayfası pageSize=1 ile istenip totalCount okunur; öğrenilmiş atlama oranı,
+# çözülmemiş IMEI sayısı ve geçmiş istek süreleriyle bölüm başına istek/süre tahmin edilir.
+# Bölümler "çözülmemiş IMEI başına maliyet"e göre ucuzdan pahalıya sıralanır. Satışı bilinmeyen IMEI
+# kalmadıysa satış bölümleri hiç taranmaz, tarama sırasında kalmazsa durdurulur. ALIŞ her zaman tam
+# taranır: IMEI'siz YENİLENMİŞ/yenileme hizmeti satırları listeden bağımsız her alış faturasından çıkabilir.
+PLAN_SECTION_NAMES = {"in": "ALIŞ", "arch": "SATIŞ-eArşiv", "out": "SATIŞ-Giden", "docnos": "SATIŞ-Hedefli"}
+
+def default_section_order(scan_sales: bool, has_docnos: bool) -> List[str]:
+    if not scan_sales: return ["in"]
+    return ["docnos", "in"] if has_docnos else ["in", "arch", "out"]
+
+def probe_counts(token: str, start: str, end: str, keys: List[str], log, stop_evt) -> Dict[str, Tuple[int,int]]:
+    """{bölüm: (arşivsiz, arşivli)} kayıt sayısı; okunamayan -1."""
+    urls = {"in": EINV_IN_LIST, "arch": EARCH_OUT_LIST, "out": EINV_OUT_LIST}
+    start = start or DEFAULT_DATE_START; end = end or _today_str(); jobs = [(k, a) for k in keys for a in (False, True)]
+    def one(job: Tuple[str,bool]) -> int:
+        batch, tc = list_page(urls[job[0]], token, start, end, 1, log, stop_evt, job[1], f"PLAN {PLAN_SECTION_NAMES[job[0]]}", page_size=1)
+        return tc if batch is not None else -1
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as ex: res = dict(zip(jobs, ex.map(one, jobs)))
+    return {k: (res[(k, False)], res[(k, True)]) for k in keys}
+
+def estimate_section(key: str, counts: Tuple[int,int], n_docnos: int, skip_rate: float, workers_max: int, lat_list: float, lat_xml: float) -> Dict[str,Any]:
+    c = [max(0, x) for x in counts]; pages = [max(1, math.ceil(x / PAGE_SIZE)) for x in c]
+    if key == "docnos": # her belge için arşiv durumu başına ~log2(sayfa) ikili arama; tam listelemeyi aşamaz
+        list_req = min(sum(pages), max(1, n_docnos) * sum(math.ceil(math.log2(p + 1)) + 1 for p in pages)); xml = n_docnos
+    else:
+        list_req = sum(pages); xml = round(sum(c) * (1 - skip_rate)) if key == "in" else sum(c)
+    # İndirme, listelemenin sayfa hızına yetişecek kadar paralel olsun; bölümdeki fatura sayısını ve üst sınırı aşmasın.
+    # Sayı okunamadıysa (ya da 0 geldiyse) tahmine güvenilmez → ayarlardaki eşzamanlılık kullanılır
+    unknown = min(counts) < 0
+    workers = max(1, workers_max) if unknown or not xml else max(1, min(workers_max, xml, math.ceil(PAGE_SIZE * lat_xml / max(lat_list, 1e-3))))
+    # Listeleme ile indirme boru hattında örtüşür → bölüm süresi ikisinden uzun olanı kadar
+    secs = max(list_req * lat_list, xml * lat_xml / workers) + lat_list
+    return {"key": key, "skip": False, "count": sum(c), "unknown": unknown, "list_req": list_req, "xml_req": xml, "workers": workers, "seconds": secs}
+
+def make_scan_plan(counts: Dict[str, Dict[str, Tuple[int,int]]], order: List[str], n_docnos: int, skip_rate: float, unresolved: Dict[str,int], workers_max: int, lat_list: float, lat_xml: float) -> Dict[str,Any]:
+    """counts: {firma: {bölüm: (arşivsiz, arşivli)}}; unresolved: {"in": alışı bilinmeyen, "out": satışı bilinmeyen} IMEI sayısı."""
+    plan: Dict[str,Any] = {"companies": {}, "list_req": 0, "xml_req": 0, "seconds": 0.0}
+    for company, per in counts.items():
+        secs: Dict[str, Dict[str,Any]] = {}
+        for key in order:
+            cnt = per.get("in") if key == "in" else tuple(map(sum, zip(per.get("arch", (0, 0)), per.get("out", (0, 0))))) if key == "docnos" else per.get(key)
+            S = secs[key] = estimate_section(key, cnt or (-1, -1), n_docnos, skip_rate if key == "in" else 0.0, workers_max, lat_list, lat_xml)
+            need = unresolved.get("in" if key == "in" else "out", 0)
+            if key != "in" and not need: S.update(skip=True, list_req=0, xml_req=0, seconds=0.0)
+            S["score"] = (S["list_req"] + S["xml_req"]) / need if need else float("inf")
+        # Sayısı okunamayan bölüm en ucuz görünür; maliyeti bilinmediği için sona alınır
+        C = {"order": sorted(order, key=lambda k: (secs[k]["unknown"], secs[k]["score"], secs[k]["list_req"] + secs[k]["xml_req"])), "sections": secs, "seconds": sum(S["seconds"] for S in secs.values())}
+        plan["companies"][company] = C
+        plan["list_req"] += sum(S["list_req"] for S in secs.values()); plan["xml_req"] += sum(S["xml_req"] for S in secs.values())
+        plan["seconds"] = max(plan["seconds"], C["seconds"]) # firmalar paralel taranır
+    return plan
+
+def format_scan_plan(plan: Dict[str,Any], multi: bool) -> str:
+    out = []
+    for company, C in plan["companies"].items():
+        head = f"{company}: " if multi else ""
+        for key in C["order"]:
+            S = C["sections"][key]
+            if S["skip"]: out.append(f"{head}{PLAN_SECTION_NAMES[key]}: atlanır (tüm IMEI'lerin satışı biliniyor)"); continue
+            out.append(f"{head}{PLAN_SECTION_NAMES[key]}: {'?' if S['unknown'] else S['count']} fatura → liste {S['list_req']} + XML {S['xml_req']} istek, {S['workers']} eşzamanlı, ~{S['seconds']:.0f} sn")
+    out.append(f"Toplam: ~{plan['list_req'] + plan['xml_req']} istek, ~{plan['seconds'] / 60:.1f} dk")
+    if plan.get("gp", (0,))[0]: out.append(f"GP: {plan['gp'][0]} kaynak ({plan['gp'][1]} önbellekte)")
+    return "\n".join(out)
+
+def gp_is_cached(url: str) -> bool:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.exists(os.path.join(GP_CACHE_DIR, key + ".bin"))
+
+# ====================== Dağıtık Tarama (Paylaşımlı İş Kuyruğu) ======================
+# Listeleme adımı fatura id'lerini SQLite kuyruğuna iş olarak yazar; bu makinedeki veya
+# paylaşımlı klasörü gören diğer makinelerdeki işçiler işleri kapar, XML'i indirip ayrıştırır
+# ve sonucu geri yazar. Raporu koordinatör (App) sonuçları sırayla birleştirerek kurar.
+QUEUE_LEASE_SEC   = 300
+QUEUE_MAX_ATTEMPT = 3
+QUEUE_STALL_SEC   = 2 * QUEUE_LEASE_SEC  # bu süre ilerleme yoksa bekleme bırakılır (uzak işçi kalmamış sayılır)
+QUEUE_ORPHAN_SEC  = 60                   # yerel işçilerin tümü çıktıysa ilerlemesiz beklenen süre
+QUEUE_DOC_TPL = {"in": EINV_IN_DOC, "arch": EARCH_OUT_DOC, "out": EINV_OUT_DOC}
+QUEUE_KIND    = {"in": "", "arch": "E-ARŞİV", "out": "E-FATURA"}
+
+class JobQueue:
+    def __init__(self, path: str):
+        self.path = path
+        with self._conn() as c:
+            c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, run_id TEXT, company TEXT,
+                section TEXT, inv_id TEXT, doc_no TEXT, status TEXT DEFAULT 'pending',
+                worker TEXT, claimed_at REAL, attempts INTEGER DEFAULT 0, result TEXT)""")
+            c.execute("CREATE INDEX IF NOT EXISTS jobs_run_status ON jobs(run_id, status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Ağ paylaşımında da çalışsın diye WAL yerine varsayılan günlük modu kullanılır
+        return sqlite3.connect(self.path, timeout=60)
+
+    def enqueue(self, run_id: str, company: str, section: str, metas: List[Dict[str,Any]]) -> int:
+        rows = []
+        for m in metas:
+            inv_id = str(m.get("id") or "")
+            if inv_id: rows.append((f"{run_id}|{company}|{section}|{inv_id}", run_id, company, section, inv_id, str(m.get("documentNumber") or inv_id)))
+        with self._conn() as c:
+            before = c.total_changes
+            c.executemany("INSERT OR IGNORE INTO jobs(id, run_id, company, section, inv_id, doc_no) VALUES (?,?,?,?,?,?)", rows)
+            return c.total_changes - before
+
+    def claim(self, worker: str, limit: int = 10) -> List[Tuple[str,str,str,str]]:
+        c = self._conn()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Kiralaması dolan ve deneme hakkı biten iş yeniden dağıtılmaz (işçiyi çökerten iş sonsuza dek dönmesin)
+            c.execute("UPDATE jobs SET status='failed' WHERE status='claimed' AND claimed_at < ? AND attempts >= ?", (now - QUEUE_LEASE_SEC, QUEUE_MAX_ATTEMPT))
+            got = c.execute("SELECT id, company, section, inv_id FROM jobs WHERE status='pending' OR (status='claimed' AND claimed_at < ?) ORDER BY seq LIMIT ?", (now - QUEUE_LEASE_SEC, limit)).fetchall()
+            c.executemany("UPDATE jobs SET status='claimed', worker=?, claimed_at=?, attempts=attempts+1 WHERE id=?", [(worker, now, g[0]) for g in got])
+            c.execute("COMMIT")
+            return got
+        except Exception:
+            c.execute("ROLLBACK"); raise
+        finally: c.close()
+
+    def complete(self, job_id: str, result: Optional[Dict[str,Any]]) -> bool:
+        # Tekrarlanan tamamlama zararsızdır: ilk yazan kazanır (süresi dolmuş kiralama → iki işçi aynı işi bitirebilir)
+        with self._conn() as c:
+            return c.execute("UPDATE jobs SET status='done', result=? WHERE id=? AND status!='done'", (json.dumps(result, ensure_ascii=False) if result is not None else None, job_id)).rowcount == 1
+
+    def fail(self, job_id: str):
+        with self._conn() as c:
+            c.execute("UPDATE jobs SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END WHERE id=? AND status='claimed'", (QUEUE_MAX_ATTEMPT, job_id))
+
+    def counts(self, run_id: str) -> Dict[str,int]:
+        with self._conn() as c:
+            return dict(c.execute("SELECT status, COUNT(*) FROM jobs WHERE run_id=? GROUP BY status", (run_id,)).fetchall())
+
+    def results(self, run_id: str):
+        with self._conn() as c:
+            for company, section, inv_id, doc_no, res in c.execute("SELECT company, section, inv_id, doc_no, result FROM jobs WHERE run_id=? AND status='done' ORDER BY seq", (run_id,)):
+                yield company, section, inv_id, doc_no, (Parsed.from_dict(json.loads(res)) if res else None)
+
+def worker_token_profiles(settings: Dict[str,Any]) -> Dict[str,str]:
+    tokens: Dict[str,str] = {}
+    if settings.get("api_token"): tokens[settings.get("company_name") or "ANA"] = settings["api_token"]
+    for p in settings.get("token_profiles", []):
+        if p.get("name") and p.get("token"): tokens[p["name"]] = p["token"]
+    try: tokens.update(json.loads(os.environ.get("NES_TOKEN_PROFILES") or "{}"))
+    except ValueError: pass
+    return tokens
+
+def run_queue_worker(db_path: str, tokens: Dict[str,str], log, stop_evt: threading.Event, worker_id: str = "", idle_exit: float = 0, batch: int = 10) -> int:
+    q = JobQueue(db_path); worker_id = worker_id or f"{platform.node() or 'PC'}-{os.getpid()}"
+    done = 0; idle_since = time.time()
+    log(f"[İŞÇİ {worker_id}] Kuyruk: {db_path}")
+    while not stop_evt.is_set():
+        jobs = q.claim(worker_id, batch)
+        if not jobs:
+            if idle_exit and time.time() - idle_since >= idle_exit: break
+            stop_evt.wait(1.0); continue
+        for job_id, company, section, inv_id in jobs:
+            token = tokens.get(company)
+            if not token: log(f"[İŞÇİ {worker_id}] '{company}' için token yok, iş bırakıldı."); q.fail(job_id); continue
+            xmlb = fetch_xml_by(QUEUE_DOC_TPL[section], token, inv_id)
+            if not xmlb: q.fail(job_id); continue
+            q.complete(job_id, parse_invoice_xml(xmlb).to_dict()); done += 1
+        idle_since = time.time()
+    log(f"[İŞÇİ {worker_id}] Bitti. Tamamlanan iş: {done}")
+    return done
+
+def spawn_local_workers(db_path: str, n: int, tokens: Dict[str,str]) -> List[subprocess.Popen]:
+    env = dict(os.environ, NES_TOKEN_PROFILES=json.dumps(tokens))
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", db_path, "--idle-exit", "600"], env=env) for _ in range(max(0, n))]
+
+# ====================== IMEI Sorgu Servisi ======================
+# Taramalar bitince rapor satırları REPORT_DB'ye yazılır; yerel HTTP/JSON servisi bu dosyayı belleğe
+# alıp tekil ve toplu IMEI sorgularını yanıtlar (dosya değişince kendiliğinden yeniden yükler).
+def save_report_store(rows: List[List[Any]], path: str = REPORT_DB) -> int:
+    data = [(r[0], json.dumps(ensure_len(list(r)), ensure_ascii=False)) for r in rows if r and re.fullmatch(r"\d{15}", str(r[0]))]
+    with sqlite3.connect(path, timeout=60) as c:
+        c.execute("CREATE TABLE IF NOT EXISTS report (imei TEXT PRIMARY KEY, row TEXT NOT NULL)")
+        c.execute("DELETE FROM report")
+        c.executemany("INSERT OR REPLACE INTO report(imei, row) VALUES (?,?)", data)
+    return len(data)
+
+def imei_answer(imei: str, row: Optional[List[Any]]) -> Dict[str,Any]:
+    if row is None: return {"imei": imei, "found": False}
+    fatura = "Fatura" in row[18] or row[3].startswith("FATURA"); gp = "Gider Pusulası" in row[18] or row[3] == "GİDER PUSULASI"
+    return {
+        "imei": imei, "found": True, "alis_belgesi": fatura or gp, "alis_faturasi": fatura, "gider_pusulasi": gp,
+        "satildi": row[19] == "Satılmış", "durumu": row[19], "sinif": row[22], "kayit": dict(zip(HEADERS, row)),
+    }
+
+class ImeiStore:
+    def __init__(self, path: str = REPORT_DB):
+        self.path = path; self.rows: Dict[str, List[Any]] = {}; self.mtime = None; self.checked = 0.0; self.lock = threading.Lock()
+    def _maybe_reload(self):
+        now = time.time()
+        if now - self.checked < 1.0: return
+        with self.lock:
+            if now - self.checked < 1.0: return
+            self.checked = now
+            try: mt = os.path.getmtime(self.path)
+            except OSError: return
+            if mt == self.mtime: return
+            with sqlite3.connect(self.path, timeout=60) as c:
+                self.rows = {im: json.loads(r) for im, r in c.execute("SELECT imei, row FROM report")}
+            self.mtime = mt
+    def get(self, imei: str) -> Dict[str,Any]:
+        self._maybe_reload(); im = norm(imei); return imei_answer(im, self.rows.get(im))
+    def get_many(self, imeis: List[str]) -> List[Dict[str,Any]]:
+        self._maybe_reload(); rows = self.rows
+        return [imei_answer(norm(im), rows.get(norm(im))) for im in imeis]
+
+class ImeiLookupHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # bağlantı tekrar kullanımı: POS tarafında saniyede binlerce sorgu için
+    disable_nagle_algorithm = True  # başlık ve gövde ayrı yazılır; Nagle + gecikmeli ACK her yanıta ~40 ms ekler
+    store: ImeiStore = None
+    def log_message(self, fmt, *args): pass
+    def _send(self, code: int, obj: Any):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code); self.send_header("Content-Type", "application/json; charset=utf-8"); self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+    def do_GET(self):
+        u = urlparse(self.path); parts = [p for p in u.path.split("/") if p]
+        if parts == ["health"]:
+            self.store._maybe_reload(); return self._send(200, {"ok": True, "kayit": len(self.store.rows)})
+        if parts[:1] == ["imei"] and len(parts) == 2: return self._send(200, self.store.get(parts[1]))
+        if parts == ["imei"]:
+            q = [x for v in parse_qs(u.query).get("q", []) for x in v.split(",") if x.strip()]
+            return self._send(200, {"sonuclar": self.store.get_many(q)})
+        self._send(404, {"hata": "bilinmeyen yol"})
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/imei/batch": return self._send(404, {"hata": "bilinmeyen yol"})
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"[]")
+            imeis = data.get("imeis", []) if isinstance(data, dict) else data
+            if not isinstance(imeis, list): raise ValueError
+        except ValueError: return self._send(400, {"hata": "gövde JSON liste ya da {\"imeis\": [...]} olmalı"})
+        self._send(200, {"sonuclar": self.store.get_many([str(x) for x in imeis])})
+
+def serve_imei_lookup(host: str, port: int, store_path: str = REPORT_DB, log=print):
+    handler = type("Handler", (ImeiLookupHandler,), {"store": ImeiStore(store_path)})
+    srv = ThreadingHTTPServer((host, port), handler); srv.daemon_threads = True
+    log(f"IMEI sorgu servisi: http://{host}:{srv.server_port}/imei/<imei>  (toplu: POST /imei/batch) – kaynak {store_path}")
+    try: srv.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: srv.server_close()
+
+# ====================== Profil Modu ======================
+# Tarama süresince tüm iş parçacıklarından yığın örneği alınır (flamegraph için "collapsed" biçim),
+# çağıran iş parçacığı cProfile ile ölçülür ve tracemalloc ile en çok bellek ayıran satırlar raporlanır.
+class StackSampler(threading.Thread):
+    def __init__(self, interval: float = 0.005, skip_main: bool = False):
+        super().__init__(daemon=True, name="StackSampler")
+        self.interval = interval; self.skip_main = skip_main
+        self.counts: Counter = Counter(); self._halt = threading.Event()
+    def run(self):
+        me = threading.get_ident(); main_id = threading.main_thread().ident
+        while not self._halt.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me or (self.skip_main and tid == main_id): continue
+                stack = []
+                while frame is not None:
+                    co = frame.f_code; stack.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})"); frame = frame.f_back
+                stack.append(names.get(tid, str(tid)).replace(";", "_"))
+                self.counts[";".join(reversed(stack))] += 1
+    def halt(self): self._halt.set(); self.join(timeout=2)
+    def write_collapsed(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.counts.most_common(): f.write(f"{stack} {n}\n")
+
+@contextlib.contextmanager
+def profile_scan(out_base: str, log, top_n: int = 40, skip_main: bool = False):
+    """out_base_profil.folded (flamegraph), out_base_profil.pstats (cProfile) ve out_base_bellek.txt yazar."""
+    sampler = StackSampler(skip_main=skip_main); prof = cProfile.Profile()
+    tracemalloc.start(25); t0 = time.time(); sampler.start(); prof.enable()
+    try: yield
+    finally:
+        prof.disable(); sampler.halt(); elapsed = time.time() - t0
+        snap = tracemalloc.take_snapshot(); cur, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+        try:
+            sampler.write_collapsed(out_base + "_profil.folded"); prof.dump_stats(out_base + "_profil.pstats")
+            snap = snap.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"), tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")))
+            with open(out_base + "_bellek.txt", "w", encoding="utf-8") as f:
+                f.write(f"Süre: {elapsed:.1f} sn  Örnek: {sum(sampler.counts.values())}  Bellek: şu an {cur/1048576:.1f} MB, tepe {peak/1048576:.1f} MB\n\n")
+                f.write(f"En çok bellek ayıran {top_n} satır:\n")
+                for st in snap.statistics("lineno")[:top_n]: f.write(f"{st}\n")
+                f.write(f"\nEn büyük 10 çağrı zinciri:\n")
+                for st in snap.statistics("traceback")[:10]:
+                    f.write(f"\n{st.size/1024:.1f} KiB, {st.count} blok\n"); f.write("\n".join(st.traceback.format(limit=8)) + "\n")
+            log(f"📊 Profil yazıldı: {out_base}_profil.folded / _profil.pstats / _bellek.txt (tepe bellek {peak/1048576:.1f} MB)")
+        except OSError as e: log(f"❌ Profil yazılamadı: {e}")
+
 # ====================== GUI ======================
 class App(tk.Tk):
     def __init__(self):
@@ -508,6 +1228,7 @@ class App(tk.Tk):
         self.worker = None
         self.rows: List[List[Any]] = []
         self.iid_to_row_index: Dict[str,int] = {}
+        self.summary = ReportSummary()
         self.imei_to_iid: Dict[str,str] = {}
         self.iid_to_ids: Dict[str, Dict[str,str]] = {}
         self.seen_in_pairs  = set(); self.seen_out_pairs = set()
@@ -519,7 +1240,13 @@ class App(tk.Tk):
         self.imei_kdv_out: Dict[str, Set[int]] = {}
         self.imei_flags: Dict[str, Dict[str,bool]] = {}
         self.docnos_filter: Set[str] = set()
+        self._merge_lock = threading.RLock()
+        self.supplier_stats = SupplierStats()
+        self._open_sales: Optional[Set[str]] = None # planlayıcının satışı henüz bilinmeyen IMEI'leri (erken durdurma)
+        self._fill_gen = 0; self._filling = False # oturum tablosu parça parça doluyor mu (tablo temizlenince nesil artar)
         self._build_ui()
+        if self.settings.get("restore_session", True) and os.path.exists(SESSION_FILE):
+            self.after(50, self._restore_session)
 
     def _build_ui(self):
         top = ttk.LabelFrame(self, text="Kimlik & Klasör"); top.pack(fill="x", padx=12, pady=6)
@@ -531,6 +1258,9 @@ class App(tk.Tk):
         self.tk_dir = tk.StringVar(value=self.settings.get("download_dir", os.getcwd()))
         ttk.Entry(top, textvariable=self.tk_dir, width=40).grid(row=0, column=6, sticky="we")
         ttk.Button(top, text="Seç", command=self._pick_dir).grid(row=0, column=7, padx=6)
+        ttk.Label(top, text="Ek Firmalar (Ad=Token):").grid(row=1, column=0, sticky="ne")
+        self.tk_profiles = tk.Text(top, height=2, width=60); self.tk_profiles.grid(row=1, column=1, columnspan=6, sticky="we", padx=6, pady=4)
+        self.tk_profiles.insert("1.0", "\n".join(f"{p.get('name','')}={p.get('token','')}" for p in self.settings.get("token_profiles", []) if p.get("token")))
         for c in range(8): top.columnconfigure(c, weight=1)
         flt = ttk.LabelFrame(self, text="Filtreler (Sadece NES API için geçerlidir)"); flt.pack(fill="x", padx=12, pady=6)
         for c in range(16): flt.columnconfigure(c, weight=1)
@@ -564,6 +1294,10 @@ class App(tk.Tk):
         ttk.Checkbutton(sub, text="PDF indir", variable=self.tk_get_pdf).pack(side="left", padx=6)
         ttk.Checkbutton(sub, text="XML indir", variable=self.tk_get_xml).pack(side="left", padx=6)
         ttk.Checkbutton(sub, text="Bittiğinde otomatik Excel yaz", variable=self.tk_auto_xlsx).pack(side="left", padx=6)
+        self.tk_profile = tk.BooleanVar(value=False)
+        ttk.Checkbutton(sub, text="Profil çıkar", variable=self.tk_profile).pack(side="left", padx=6)
+        self.tk_skip_learning = tk.BooleanVar(value=bool(self.settings.get("skip_learning", True)))
+        ttk.Checkbutton(sub, text="IMEI'siz tedarikçileri atla (öğrenilmiş)", variable=self.tk_skip_learning).pack(side="left", padx=6)
         docf = ttk.LabelFrame(self, text="Fatura No Listesi (EAR/EFR) – isteğe bağlı"); docf.pack(fill="x", padx=12, pady=6)
         row = ttk.Frame(docf); row.pack(fill="x", padx=8, pady=4)
         self.tk_docnos_count = tk.StringVar(value="Seçili fatura: 0")
@@ -575,6 +1309,10 @@ class App(tk.Tk):
         self.tk_timeout_c = tk.IntVar(value=int(self.settings.get("timeout_connect", DEFAULTS["timeout_connect"]))); self.tk_timeout_r = tk.IntVar(value=int(self.settings.get("timeout_read", DEFAULTS["timeout_read"]))); self.tk_retries   = tk.IntVar(value=int(self.settings.get("retries", DEFAULTS["retries"]))); self.tk_backoff   = tk.DoubleVar(value=float(self.settings.get("backoff", DEFAULTS["backoff"])))
         ttk.Label(net, text="Bağlantı timeout (sn):").grid(row=0, column=0, sticky="e"); ttk.Entry(net, textvariable=self.tk_timeout_c, width=6).grid(row=0, column=1, sticky="w", padx=6); ttk.Label(net, text="Okuma timeout (sn):").grid(row=0, column=2, sticky="e"); ttk.Entry(net, textvariable=self.tk_timeout_r, width=6).grid(row=0, column=3, sticky="w", padx=6); ttk.Label(net, text="Retry deneme:").grid(row=0, column=4, sticky="e"); ttk.Entry(net, textvariable=self.tk_retries, width=4).grid(row=0, column=5, sticky="w", padx=6); ttk.Label(net, text="Backoff (saniye çarpanı):").grid(row=0, column=6, sticky="e"); ttk.Entry(net, textvariable=self.tk_backoff, width=6).grid(row=0, column=7, sticky="w", padx=6)
         for c in range(8): net.columnconfigure(c, weight=1)
+        dist = ttk.LabelFrame(opts, text="Dağıtık Tarama (paylaşımlı iş kuyruğu) – isteğe bağlı"); dist.pack(fill="x", padx=8, pady=6)
+        self.tk_queue_db = tk.StringVar(value=self.settings.get("queue_db", "")); self.tk_queue_workers = tk.IntVar(value=int(self.settings.get("queue_local_workers", DEFAULTS["queue_local_workers"])))
+        ttk.Label(dist, text="Kuyruk dosyası (.sqlite, boş = kapalı):").grid(row=0, column=0, sticky="e"); ttk.Entry(dist, textvariable=self.tk_queue_db, width=60).grid(row=0, column=1, sticky="we", padx=6); ttk.Label(dist, text="Yerel işçi süreci:").grid(row=0, column=2, sticky="e"); ttk.Entry(dist, textvariable=self.tk_queue_workers, width=4).grid(row=0, column=3, sticky="w", padx=6)
+        dist.columnconfigure(1, weight=1)
         ext = ttk.LabelFrame(self, text="Gider Pusulası Kaynakları (URL veya Dosya)"); ext.pack(fill="x", padx=12, pady=6)
         self.tk_gp_urls = tk.Text(ext, height=3); self.tk_gp_urls.pack(fill="x", padx=6, pady=6)
         self.tk_gp_urls.insert("1.0", "https://docs.google.com/spreadsheets/d/e/2PACX-1vSDMPeXeKs0HSD38CJst-_1AevO_YuZYtQa7jg-ra0OWQmxi-6qqXGEbqDO_I8ToQ/pub?output=xlsx\n")
@@ -586,6 +1324,7 @@ class App(tk.Tk):
         ttk.Button(act, text="2. Raporu Tamamla (NES + GP)", command=self._start_scan).pack(side="left", padx=4)
         ttk.Button(act, text="Seçili → İndir", command=self._download_selected).pack(side="left", padx=4)
         ttk.Button(act, text="Excel'e Aktar", command=self._export_excel).pack(side="left", padx=4)
+        ttk.Button(act, text="Özet", command=self._show_summary).pack(side="left", padx=4)
         self.btn_stop = ttk.Button(act, text="Durdur", command=self._stop_now, state="disabled"); self.btn_stop.pack(side="right", padx=4)
         self.tree = ttk.Treeview(self, columns=HEADERS, show="headings", height=22)
         for c in HEADERS:
@@ -600,8 +1339,67 @@ class App(tk.Tk):
         self.log = scrolledtext.ScrolledText(logf, height=11); self.log.pack(fill="x", padx=8, pady=6)
 
     def _log(self, msg: str): self.log.insert(tk.END, msg + "\n"); self.log.see(tk.END)
+    def _busy(self) -> bool:
+        if self.worker and self.worker.is_alive(): messagebox.showinfo("Bilgi", "Devam eden iş var. Önce durdurun."); return True
+        if self._filling: messagebox.showinfo("Bilgi", "Son oturum tabloya yükleniyor, lütfen bitmesini bekleyin."); return True
+        return False
+    def _clear_table(self):
+        self._fill_gen += 1; self._filling = False # yarıda kalan oturum doldurması eski satırlara dokunmasın
+        self.tree.delete(*self.tree.get_children())
+        self.rows.clear(); self.iid_to_row_index.clear(); self.imei_to_iid.clear(); self.iid_to_ids.clear(); self.summary.reset()
+    def _insert_row(self, row: List[Any]) -> str:
+        row = ensure_len(row); iid = self.tree.insert("", "end", values=row)
+        self.iid_to_row_index[iid] = len(self.rows); self.rows.append(row); self.summary.add(row)
+        return iid
+    def _set_row(self, iid: str, vals: List[Any]):
+        vals = ensure_len(vals); self.tree.item(iid, values=vals)
+        idx = self.iid_to_row_index.get(iid)
+        if idx is not None: self.summary.replace(self.rows[idx], vals); self.rows[idx] = vals
+    def _session_state(self) -> Dict[str,Any]:
+        with self._merge_lock:
+            ridx = self.iid_to_row_index
+            return {
+                "version": 2, "rows": [list(r) for r in self.rows],
+                "imei_rows": {im: ridx[iid] for im, iid in self.imei_to_iid.items() if iid in ridx},
+                "ids_rows": {str(ridx[iid]): dict(ids) for iid, ids in self.iid_to_ids.items() if iid in ridx},
+                "force_imeis_order": list(self.force_imeis_order),
+                "seen_in_pairs": list(self.seen_in_pairs), "seen_out_pairs": list(self.seen_out_pairs),
+                "imei_kdv_in": {k: sorted(v) for k, v in self.imei_kdv_in.items()}, "imei_kdv_out": {k: sorted(v) for k, v in self.imei_kdv_out.items()},
+                "imei_flags": {k: dict(v) for k, v in self.imei_flags.items()}, "docnos_filter": sorted(self.docnos_filter),
+                "summary": self.summary.state(),
+            }
+    def _save_session(self):
+        try:
+            t0 = time.time(); st = self._session_state(); save_session_snapshot(st)
+            self._log(f"💾 Oturum kaydedildi: {len(st['rows'])} satır ({time.time()-t0:.1f} sn)")
+        except Exception as e: self._log(f"❌ Oturum kaydedilemedi: {e}")
+    def _restore_session(self):
+        try: st = load_session_snapshot()
+        except Exception as e: self._log(f"❌ Oturum okunamadı: {e}"); return
+        if not st or st.get("version") != 2: return
+        self._clear_table()
+        self.force_imeis_order[:] = st["force_imeis_order"]; self.force_imeis_set = set(self.force_imeis_order)
+        self.seen_in_pairs = set(map(tuple, st["seen_in_pairs"])); self.seen_out_pairs = set(map(tuple, st["seen_out_pairs"]))
+        self.imei_kdv_in = {k: set(v) for k, v in st["imei_kdv_in"].items()}; self.imei_kdv_out = {k: set(v) for k, v in st["imei_kdv_out"].items()}; self.imei_flags = st["imei_flags"]
+        self._set_docnos(st.get("docnos_filter", []))
+        rows = st["rows"]; row_imei = {i: im for im, i in st["imei_rows"].items()}; ids_rows = {int(k): v for k, v in st["ids_rows"].items()}
+        self.rows.extend(ensure_len(r) for r in rows)
+        if st.get("summary"): self.summary = ReportSummary(st["summary"])
+        else:
+            for r in self.rows: self.summary.add(r)
+        # Tabloya parça parça eklenir; pencere büyük oturumlarda da hemen kullanılabilir kalır
+        gen = self._fill_gen; self._filling = True
+        def fill(i: int = 0, chunk: int = 2000):
+            if gen != self._fill_gen: return
+            for k in range(i, min(i + chunk, len(rows))):
+                iid = self.tree.insert("", "end", values=self.rows[k]); self.iid_to_row_index[iid] = k
+                if k in row_imei: self.imei_to_iid[row_imei[k]] = iid
+                if k in ids_rows: self.iid_to_ids[iid] = ids_rows[k]
+            if i + chunk < len(rows): self.after(1, fill, i + chunk)
+            else: self._filling = False; self._log(f"📂 Son oturum yüklendi: {len(rows)} satır, {len(self.force_imeis_set)} IMEI")
+        fill()
     def _save_settings(self):
-        s = self.settings; s["api_token"] = self.tk_token.get().strip(); s["download_dir"] = self.tk_dir.get().strip() or os.getcwd(); s["out_name"] = s.get("out_name", DEFAULTS["out_name"]); s["timeout_connect"] = int(self.tk_timeout_c.get()); s["timeout_read"]    = int(self.tk_timeout_r.get()); s["retries"] = int(self.tk_retries.get()); s["backoff"] = float(self.tk_backoff.get()); save_settings(s); messagebox.showinfo("Bilgi", "Ayarlar kaydedildi.")
+        s = self.settings; s["api_token"] = self.tk_token.get().strip(); s["download_dir"] = self.tk_dir.get().strip() or os.getcwd(); s["out_name"] = s.get("out_name", DEFAULTS["out_name"]); s["timeout_connect"] = int(self.tk_timeout_c.get()); s["timeout_read"]    = int(self.tk_timeout_r.get()); s["retries"] = int(self.tk_retries.get()); s["backoff"] = float(self.tk_backoff.get()); s["token_profiles"] = [{"name": n, "token": t} for n, t in self._token_profiles()[1 if s["api_token"] else 0:]]; s["queue_db"] = self.tk_queue_db.get().strip(); s["queue_local_workers"] = int(self.tk_queue_workers.get() or 0); s["skip_learning"] = bool(self.tk_skip_learning.get()); save_settings(s); messagebox.showinfo("Bilgi", "Ayarlar kaydedildi.")
     def _pick_dir(self):
         d = filedialog.askdirectory(title="İndirme klasörü")
         if d: self.tk_dir.set(d)
@@ -631,42 +1429,56 @@ class App(tk.Tk):
         self._set_docnos(arr)
     def _clear_docnos(self): self._set_docnos([])
     def _load_imei_list(self):
+        if self._busy(): return
         p = filedialog.askopenfilename(title="IMEI listesi seç (Excel/CSV/TXT)", filetypes=[("Excel","*.xlsx *.xls"),("CSV","*.csv"),("Metin","*.txt"),("Tümü","*.*")])
         if not p: return
-        self.tree.delete(*self.tree.get_children())
-        self.rows.clear(); self.iid_to_row_index.clear(); self.imei_to_iid.clear(); self.iid_to_ids.clear()
+        self._clear_table()
         self.force_imeis_order.clear(); self.force_imeis_set.clear()
-
-        imeis_from_file: List[Dict] = []
+        # Yeni liste = yeni rapor; önceki oturumdan kalan eşleşme/KDV/ipucu durumu yeni satırları boş bırakmasın
+        self.seen_in_pairs.clear(); self.seen_out_pairs.clear(); self.imei_kdv_in.clear(); self.imei_kdv_out.clear(); self.imei_flags.clear()
+        self.stop_evt.clear(); self.btn_stop.config(state="normal")
+        self.worker = threading.Thread(target=self._ingest_imei_file, args=(p,), daemon=True); self.worker.start()
+    def _iter_imei_file(self, p: str) -> Iterator[Dict[str,Any]]:
+        ext = os.path.splitext(p)[1].lower()
+        if ext not in (".xlsx",".xls"): # CSV/TXT: parça parça taranır, dosya belleğe alınmaz
+            for v in iter_imeis_from_file(p): yield {"imei": v}
+            return
+        from openpyxl import load_workbook
+        wb = load_workbook(p, read_only=True, data_only=True)
         try:
-            ext = os.path.splitext(p)[1].lower()
-            if ext in (".xlsx",".xls"):
-                wb = load_workbook(p, data_only=True)
-                template_rows = parse_gp_template_workbook(wb, self._log)
-                if template_rows:
-                    for r_list in template_rows:
-                        row_dict = {h: (r_list[i] if i < len(r_list) else "") for i, h in enumerate(HEADERS)}
-                        if row_dict.get("imei"): imeis_from_file.append(row_dict)
-                else: # Basit liste, sadece ilk sütunu oku
-                    ws = wb.active
-                    for r in ws.iter_rows(min_row=1, max_col=1, values_only=True):
-                        v = str(r[0]).strip() if r and r[0] is not None else ""
-                        if re.fullmatch(r"\d{15}", v) and _luhn_ok_imei(v): imeis_from_file.append({"imei": v})
-            else: # CSV/TXT
-                with open(p, "r", encoding="utf-8-sig") as f:
-                    content = f.read()
-                    for v in extract_imeis(content):
-                        imeis_from_file.append({"imei": v})
-        except Exception as e: messagebox.showerror("Hata", f"IMEI listesi okunamadı: {e}"); return
-
-        for item_dict in imeis_from_file:
-            im = item_dict["imei"]
-            if im in self.force_imeis_set: continue
-            self.force_imeis_order.append(im); self.force_imeis_set.add(im)
-            row = [item_dict.get(h, "") for h in HEADERS]
-            iid = self.tree.insert("", "end", values=ensure_len(row))
-            self.iid_to_row_index[iid] = len(self.rows); self.rows.append(ensure_len(row)); self.imei_to_iid[im] = iid
-
+            is_template = any(_header_map_from_rows(ws.iter_rows(max_row=11, values_only=True)) for ws in wb.worksheets)
+            if not is_template: # Basit liste, sadece ilk sütunu oku (salt-okunur akış)
+                for r in wb.active.iter_rows(min_row=1, max_col=1, values_only=True):
+                    v = str(r[0]).strip() if r and r[0] is not None else ""
+                    if re.fullmatch(r"\d{15}", v) and _luhn_ok_imei(v): yield {"imei": v}
+                return
+        finally: wb.close()
+        wb = load_workbook(p, data_only=True)
+        for r_list in parse_gp_template_workbook(wb, self._log):
+            row_dict = {h: (r_list[i] if i < len(r_list) else "") for i, h in enumerate(HEADERS)}
+            if row_dict.get("imei"): yield row_dict
+    def _ingest_imei_file(self, p: str, batch: int = 5000):
+        self._log(f"📥 IMEI listesi okunuyor: {p}")
+        pending: List[List[Any]] = []
+        def flush():
+            with self._merge_lock:
+                for row in pending:
+                    self.imei_to_iid[row[0]] = self._insert_row(row)
+            pending.clear()
+        try:
+            for item_dict in self._iter_imei_file(p):
+                if self.stop_evt.is_set(): break
+                im = item_dict["imei"]
+                with self._merge_lock:
+                    if im in self.force_imeis_set: continue
+                    self.force_imeis_order.append(im); self.force_imeis_set.add(im)
+                pending.append(ensure_len([item_dict.get(h, "") for h in HEADERS]))
+                if len(pending) >= batch:
+                    flush(); self._log(f"  … {len(self.force_imeis_set)} IMEI")
+            flush()
+        except Exception as e: flush(); messagebox.showerror("Hata", f"IMEI listesi okunamadı: {e}"); return
+        finally: self.btn_stop.config(state="disabled")
+        if self.stop_evt.is_set(): self._log(f"⏹ IMEI listesi okuma durduruldu: {len(self.force_imeis_set)} IMEI yüklendi."); return
         self._log(f"📥 IMEI listesi yüklendi ve tablo oluşturuldu: {len(self.force_imeis_set)} adet")
     def _merge_gp_ready_rows(self, rows_ready: List[List[Any]]):
         add_new = self.tk_add_new_imeis.get()
@@ -683,40 +1495,37 @@ class App(tk.Tk):
                 for i, h in enumerate(HEADERS[:20]):
                     if not cur[i] and rd.get(h): cur[i] = rd[h]
                 cur[1] = "XML+GP" if (cur[1] and cur[1] != "GP") else (cur[1] or "GP")
-                self.tree.item(iid, values=cur)
-                idxr = self.iid_to_row_index.get(iid)
-                if idxr is not None: self.rows[idxr] = ensure_len(cur)
+                self._set_row(iid, cur)
                 merged += 1
             else:
                 if add_new:
                     if im not in self.force_imeis_set:
                         self.force_imeis_order.append(im); self.force_imeis_set.add(im)
                     row = [rd.get(h, "") for h in HEADERS]
-                    iid = self.tree.insert("", "end", values=ensure_len(row))
-                    self.iid_to_row_index[iid] = len(self.rows); self.rows.append(ensure_len(row)); self.imei_to_iid[im] = iid; added += 1
+                    self.imei_to_iid[im] = self._insert_row(row); added += 1
                 else: skipped += 1
             if self.imei_to_iid.get(im):
                 self._update_classification_for(im)
         self._log(f"[GP Şablon] Birleştirilen={merged}, Yeni Eklenen={added}, Atlanan={skipped}")
     def _load_gp_from_urls(self):
+        if self._busy(): return
         urls = [u.strip() for u in self.tk_gp_urls.get("1.0","end").splitlines() if u.strip()]
         if not urls: messagebox.showinfo("Bilgi", "Önce en az bir URL girin."); return
         self._log(f"▶ Manuel GP Yükleme (URL'ler)...")
-        for url in urls:
-            try:
-                resp = http_get(url, token=None, typ="bin", log=self._log, stop_evt=self.stop_evt)
-                if resp is None: self._log(f"  ❌ URL yüklenemedi: {url}"); continue
-                wb = load_workbook(io.BytesIO(resp.content), data_only=True)
-                rows_ready = parse_gp_template_workbook(wb, self._log)
-                if rows_ready: self._merge_gp_ready_rows(rows_ready)
-                else: self._merge_gp_items(parse_gp_workbook(wb, self._log))
-            except Exception as e: self._log(f"  ❌ URL işlenemedi: {e}")
+        try:
+            loaded = load_gp_sources(urls, self._log, self.stop_evt)
+            rows_ready = [r for _, rows, _ in loaded for r in rows]; items = [it for _, rows, its in loaded if not rows for it in its]
+            if rows_ready: self._merge_gp_ready_rows(rows_ready)
+            if items or not rows_ready: self._merge_gp_items(items)
+        except Exception as e: self._log(f"  ❌ URL işlenemedi: {e}")
         self._log(f"✅ Manuel URL'den yükleme tamamlandı.")
     def _load_gp_from_file(self):
+        if self._busy(): return
         p = filedialog.askopenfilename(title="Gider Pusulası Excel seç", filetypes=[("Excel","*.xlsx *.xls")])
         if not p: return
         self._log("▶ Manuel GP Yükleme (Dosya)...")
         try:
+            from openpyxl import load_workbook
             wb = load_workbook(p, data_only=True)
             rows_ready = parse_gp_template_workbook(wb, self._log)
             if rows_ready: self._merge_gp_ready_rows(rows_ready)
@@ -744,17 +1553,14 @@ class App(tk.Tk):
                 if not vals[3]: vals[3] = "GİDER PUSULASI"
                 if not vals[19] or vals[19] == "ALIŞ KAYDI GEREKLİ": vals[19] = "Satılabilir"
                 vals[1] = "XML+GP" if (vals[1] and vals[1] != "GP") else (vals[1] or "GP")
-                self.tree.item(iid, values=vals)
-                idx = self.iid_to_row_index.get(iid)
-                if idx is not None: self.rows[idx] = ensure_len(vals)
+                self._set_row(iid, vals)
                 merged += 1
             else:
                 if add_new:
                     if im not in self.force_imeis_set:
                         self.force_imeis_order.append(im); self.force_imeis_set.add(im)
                     row = [ im, "GP", "", "GİDER PUSULASI", it.get("tarih",""), "GP", it.get("ad",""), borc, brand, model, "", "", "", "", "", "", "", info, "Gider Pusulası", "Satılabilir", "", "", "", "" ]
-                    iid = self.tree.insert("", "end", values=ensure_len(row))
-                    self.iid_to_row_index[iid] = len(self.rows); self.rows.append(ensure_len(row)); self.imei_to_iid.setdefault(im, iid); added += 1
+                    self.imei_to_iid.setdefault(im, self._insert_row(row)); added += 1
                 else: skipped +=1
             if self.imei_to_iid.get(im):
                 self._update_classification_for(im)
@@ -773,9 +1579,7 @@ class App(tk.Tk):
         if kdv is None: return
         s = self.imei_kdv_out.get(imei, set()); s.add(int(round(kdv))); self.imei_kdv_out[imei] = s
     def _find_kdv_for_imei(self, P: Parsed, imei: str) -> Optional[float]:
-        for L in P.lines:
-            if imei and imei in L["blob"]: return L.get("kdv", None) or P.inv_kdv
-        return P.inv_kdv
+        return P.imei_kdv(imei)
     def _stringify_kdvset(self, s: Set[int]) -> str:
         if not s: return ""
         return ",".join([str(x) for x in sorted(s)])
@@ -785,9 +1589,7 @@ class App(tk.Tk):
         vals = ensure_len(list(self.tree.item(iid, "values")))
         vals[20] = self._stringify_kdvset(self.imei_kdv_in.get(imei, set()))
         vals[21] = self._stringify_kdvset(self.imei_kdv_out.get(imei, set()))
-        self.tree.item(iid, values=vals)
-        idx = self.iid_to_row_index.get(iid)
-        if idx is not None: self.rows[idx] = ensure_len(vals)
+        self._set_row(iid, vals)
     def _update_classification_for(self, imei: str):
         iid = self.imei_to_iid.get(imei);
         if not iid: return
@@ -804,12 +1606,10 @@ class App(tk.Tk):
             klass = "2.EL"; reasons.append("Metin ipucu: 2.EL")
             if has_alis_20 and has_satis_20: reasons.append("ALIŞ 20 → SATIŞ 20")
         vals[20] = self._stringify_kdvset(k_in); vals[21] = self._stringify_kdvset(k_out); vals[22] = klass; vals[23] = "; ".join(reasons)
-        self.tree.item(iid, values=vals)
-        idx = self.iid_to_row_index.get(iid)
-        if idx is not None: self.rows[idx] = ensure_len(vals)
+        self._set_row(iid, vals)
     def _start_scan(self):
-        if self.worker and self.worker.is_alive(): messagebox.showinfo("Bilgi", "Devam eden iş var. Önce durdurun."); return
-        if not self.tk_token.get().strip(): messagebox.showwarning("Uyarı", "Önce API token girin."); return
+        if self._busy(): return
+        if not self._token_profiles(): messagebox.showwarning("Uyarı", "Önce API token girin."); return
         if not self.force_imeis_set: messagebox.showwarning("Uyarı", "Lütfen önce 'IMEI Listesi Yükle' ile bir başlangıç listesi seçin."); return
         global TIMEOUT_CONNECT, TIMEOUT_READ, RETRIES, BACKOFF, SESSION
         TIMEOUT_CONNECT = int(self.tk_timeout_c.get() or DEFAULTS["timeout_connect"]); TIMEOUT_READ = int(self.tk_timeout_r.get() or DEFAULTS["timeout_read"]); RETRIES = int(self.tk_retries.get() or DEFAULTS["retries"]); BACKOFF = float(self.tk_backoff.get() or DEFAULTS["backoff"]); SESSION = make_session(RETRIES, BACKOFF)
@@ -819,127 +1619,252 @@ class App(tk.Tk):
             self.tk_docnos_count.set(f"Seçili fatura: {len(self.docnos_filter)}")
         self.log.delete("1.0", tk.END); self.stop_evt.clear(); self.btn_stop.config(state="normal")
         self.worker = threading.Thread(target=self._scan_flow, daemon=True); self.worker.start()
+    def _token_profiles(self) -> List[Tuple[str,str]]:
+        out: List[Tuple[str,str]] = []
+        main = self.tk_token.get().strip()
+        if main: out.append((self.settings.get("company_name") or "ANA", main))
+        for ln in self.tk_profiles.get("1.0","end").splitlines():
+            if "=" not in ln: continue
+            name, tok = [x.strip() for x in ln.split("=", 1)]
+            if name and tok and all(tok != t for _, t in out): out.append((name, tok))
+        return out
     def _scan_flow(self):
+        if not self.tk_profile.get(): return self._scan_flow_run()
+        out_base = os.path.splitext(self.settings.get("out_name", DEFAULTS["out_name"]))[0]
+        with profile_scan(out_base, self._log, skip_main=True): self._scan_flow_run()
+    def _scan_flow_run(self):
         try:
-            token = self.tk_token.get().strip(); start = self.tk_start.get().strip() if self.tk_use_date.get() else ""; end   = self.tk_end.get().strip() if self.tk_use_date.get() else ""
+            start = self.tk_start.get().strip() if self.tk_use_date.get() else ""; end   = self.tk_end.get().strip() if self.tk_use_date.get() else ""
+            profiles = self._token_profiles()
+            urls = [u.strip() for u in self.tk_gp_urls.get("1.0","end").splitlines() if u.strip()]
             self._log("▶▶▶ Rapor Tamamlama Süreci Başladı...")
+            plan = self._plan_scan(profiles, start, end, urls)
+            if plan is None: self._log("⏹ Tarama planı onaylanmadı; tarama başlatılmadı."); return
+            s0 = http_stats(); t0 = time.time(); plans = plan["companies"]
             # ADIM 1: NES ARAMASI
             self._log("1. Adım: NES API üzerinden faturalar taranıyor...")
-            sales_first = self.tk_scan_sales.get() and bool(self.docnos_filter)
-            if sales_first:
-                self._log("🔸 [SATIŞ-ÖNCELİKLİ MOD] EAR/EFR listesi yüklü → önce satışlar taranacak.")
-                out_arch = list_both_archived(EARCH_OUT_LIST, token, start, end, log=self._log, stop_evt=self.stop_evt, section_name="SATIŞ-eArşiv")
-                for meta in out_arch:
-                    if self.stop_evt.is_set(): break
-                    doc_no_meta = str(meta.get("documentNumber") or "")
-                    if self.docnos_filter and doc_no_meta.upper() not in self.docnos_filter: continue
-                    inv_id = str(meta.get("id") or ""); xmlb = fetch_xml_by(EARCH_OUT_DOC, token, inv_id)
-                    if not xmlb: continue
-                    P = parse_invoice_xml(xmlb)
-                    if not P.imeis: continue
-                    for im in P.imeis: self._append_or_merge_sale(P, inv_id, P.invoice_no or doc_no_meta or inv_id, im, kind="E-ARŞİV")
-                out_einv = list_both_archived(EINV_OUT_LIST, token, start, end, log=self._log, stop_evt=self.stop_evt, section_name="SATIŞ-Giden")
-                for meta in out_einv:
-                    if self.stop_evt.is_set(): break
-                    doc_no_meta = str(meta.get("documentNumber") or "")
-                    if self.docnos_filter and doc_no_meta.upper() not in self.docnos_filter: continue
-                    inv_id = str(meta.get("id") or ""); xmlb = fetch_xml_by(EINV_OUT_DOC, token, inv_id)
-                    if not xmlb: continue
-                    P = parse_invoice_xml(xmlb)
-                    if not P.imeis: continue
-                    for im in P.imeis: self._append_or_merge_sale(P, inv_id, P.invoice_no or doc_no_meta or inv_id, im, kind="E-FATURA")
-            
-            self._log("🔹 [ALIŞ] Tarama başlıyor...")
-            incoming = list_both_archived(EINV_IN_LIST, token, start, end, log=self._log, stop_evt=self.stop_evt, section_name="ALIŞ")
-            self._log(f"🔹 [ALIŞ] Toplam tekil fatura: {len(incoming)}")
-            found_imeis = set(); refurb_rows: List[List[Any]] = []; renewal_rows: List[List[Any]] = []
-            for idx, meta in enumerate(incoming, 1):
-                if self.stop_evt.is_set(): break
-                inv_id = str(meta.get("id") or ""); doc_no = str(meta.get("documentNumber") or inv_id)
-                xmlb = fetch_xml_by(EINV_IN_DOC, token, inv_id)
-                if not xmlb: self._log(f"[ALIŞ] {idx}/{len(incoming)} {doc_no}: XML indirilemedi."); continue
-                P = parse_invoice_xml(xmlb)
-                if not P.imeis and is_whitelisted_supplier(P.supplier_name, self.settings): continue
-                if self.tk_unvan.get().strip() and (nlow(self.tk_unvan.get()) not in nlow(P.supplier_name)): continue
-                if self.tk_tckn.get().strip() and P.supplier_id != self.tk_tckn.get().strip(): continue
-                if self.tk_vkn.get().strip() and P.supplier_id != self.tk_vkn.get().strip(): continue
-                
-                imeis_to_process = [x for x in P.imeis if x in self.force_imeis_set]
-
-                for im in imeis_to_process:
-                    unit_price = ""; line_total = ""; model = P.model; brand = P.brand
-                    for L in P.lines:
-                        if im in L["blob"]: unit_price = L.get("unit_price","") or ""; line_total = L.get("line_total","") or ""; model = L["blob"]; brand = brand_from_text(L["blob"]); break
-                    borc_tutar = unit_price or line_total or P.payable
-                    self._append_or_merge_purchase(P, inv_id, P.invoice_no or doc_no, im, borc_tutar, model, brand); found_imeis.add(im)
-                
-                if not P.imeis:
-                    tU = P.text_upper
-                    if KEY_REF.search(tU): refurb_rows.append(ensure_len(["","XML",P.supplier_id,"FATURA",P.issue_date,P.invoice_no or doc_no,P.supplier_name, P.payable, brand_from_text(tU), P.model or "", "","","","","","","", "YENİLENMİŞ ürün (IMEI yok)","Fatura","Satılabilir", "","","",""]))
-                    if "CEP TELEFONU YENİLEME HİZMETİ" in tU: renewal_rows.append(ensure_len(["", "XML", P.supplier_id, "FATURA (Hizmet)", P.issue_date, P.invoice_no or doc_no, P.supplier_name, P.payable, brand_from_text(tU), P.model or "", "", "", "", "", "", "", "", P.description or "CEP TELEFONU YENİLEME HİZMETİ", "Fatura (Hizmet)", "ALIŞ KAYDI GEREKLİ", "", "", "", "Yenileme Faturası, GP'den eşleştirilmeli" ]))
-            for r in refurb_rows + renewal_rows:
-                iid = self.tree.insert("", "end", values=r); self.iid_to_row_index[iid] = len(self.rows); self.rows.append(r)
-            
-            if self.tk_scan_sales.get() and not self.stop_evt.is_set() and not sales_first:
-                self._log("🔸 [SATIŞ] Tarama başlıyor...")
-                out_arch = list_both_archived(EARCH_OUT_LIST, token, start, end, log=self._log, stop_evt=self.stop_evt, section_name="SATIŞ-eArşiv")
-                for meta in out_arch:
-                    if self.stop_evt.is_set(): break
-                    inv_id = str(meta.get("id") or ""); doc_no = str(meta.get("documentNumber") or inv_id); xmlb = fetch_xml_by(EARCH_OUT_DOC, token, inv_id)
-                    if not xmlb: continue
-                    P = parse_invoice_xml(xmlb)
-                    if P.imeis: [self._append_or_merge_sale(P, inv_id, P.invoice_no or doc_no, im, kind="E-ARŞİV") for im in P.imeis]
-                out_einv = list_both_archived(EINV_OUT_LIST, token, start, end, log=self._log, stop_evt=self.stop_evt, section_name="SATIŞ-Giden")
-                for meta in out_einv:
-                    if self.stop_evt.is_set(): break
-                    inv_id = str(meta.get("id") or ""); doc_no = str(meta.get("documentNumber") or inv_id); xmlb = fetch_xml_by(EINV_OUT_DOC, token, inv_id)
-                    if not xmlb: continue
-                    P = parse_invoice_xml(xmlb)
-                    if P.imeis: [self._append_or_merge_sale(P, inv_id, P.invoice_no or doc_no, im, kind="E-FATURA") for im in P.imeis]
-            
+            queued_jobs = None
+            if self.tk_queue_db.get().strip():
+                queued_jobs = self._scan_nes_queued(profiles, start, end, self.tk_queue_db.get().strip(), plans)
+            elif len(profiles) == 1:
+                self._scan_nes(profiles[0][0], profiles[0][1], start, end, multi=False, plan=plans.get(profiles[0][0]))
+            else:
+                self._log(f"🏢 {len(profiles)} firma paralel taranıyor: {', '.join(n for n, _ in profiles)}")
+                with ThreadPoolExecutor(max_workers=len(profiles)) as ex:
+                    futs = [ex.submit(self._scan_nes, name, tok, start, end, multi=True, plan=plans.get(name)) for name, tok in profiles]
+                    for (name, _), fut in zip(profiles, futs):
+                        try: fut.result()
+                        except Exception as e: self._log(f"❌ [{name}] NES taraması hata ile bitti: {e}")
             self._log("✅ 1. Adım (NES Arama) Tamamlandı.")
+            self._log_plan_actual(plan, s0, t0, queued_jobs)
             
             # ADIM 2: OTOMATİK GP ARAMASI
-            urls = [u.strip() for u in self.tk_gp_urls.get("1.0","end").splitlines() if u.strip()]
             if urls:
                 self._log("2. Adım: GP Linki ile eksik alış bilgileri tamamlanıyor...")
-                for url in urls:
-                    try:
-                        resp = http_get(url, token=None, typ="bin", log=self._log, stop_evt=self.stop_evt)
-                        if resp is None: self._log(f"  ❌ GP URL yüklenemedi: {url}"); continue
-                        wb = load_workbook(io.BytesIO(resp.content), data_only=True)
-                        items = parse_gp_workbook(wb, self._log)
-                        if items: self._merge_gp_items(items, from_auto_scan=True)
-                    except Exception as e: self._log(f"  ❌ GP URL işlenemedi: {e}")
+                try:
+                    items = [it for _, _, its in load_gp_sources(urls, self._log, self.stop_evt, want_template=False) for it in its]
+                    if items: self._merge_gp_items(items, from_auto_scan=True)
+                except Exception as e: self._log(f"  ❌ GP URL işlenemedi: {e}")
                 self._log("✅ 2. Adım (Otomatik GP Tamamlama) Bitti.")
 
             if self.tk_auto_xlsx.get():
                 outp = self.settings.get("out_name", DEFAULTS["out_name"])
-                try: write_excel(self._table_rows(), outp); self._log(f"🧾 Excel yazıldı: {outp}")
+                try: write_excel(self._table_rows(), outp, self.summary); self._log(f"🧾 Excel yazıldı: {outp}")
                 except Exception as e: self._log(f"❌ Excel yazılamadı: {e}")
+            self._save_session()
+            try: self._log(f"🗄 Sorgu deposu güncellendi: {save_report_store(self._table_rows())} IMEI → {REPORT_DB}")
+            except Exception as e: self._log(f"❌ Sorgu deposu yazılamadı: {e}")
+            try: self.supplier_stats.save()
+            except OSError as e: self._log(f"❌ Tedarikçi istatistiği yazılamadı: {e}")
             self._log("▶▶▶ Rapor Tamamlama Süreci Bitti.")
         except Exception as e: messagebox.showerror("Hata", str(e))
         finally: self.btn_stop.config(state="disabled")
+    def _plan_scan(self, profiles: List[Tuple[str,str]], start: str, end: str, gp_urls: List[str]) -> Optional[Dict[str,Any]]:
+        order = default_section_order(bool(self.tk_scan_sales.get()), bool(self.docnos_filter))
+        keys = [k for k in ("in", "arch", "out") if k in order or (k != "in" and "docnos" in order)]
+        self._log("📐 Tarama planı çıkarılıyor (liste uçlarının kayıt sayıları okunuyor)...")
+        hist = _read_json(PLAN_STATS_FILE) or {}; s0 = http_stats()
+        with ThreadPoolExecutor(max_workers=len(profiles)) as ex:
+            counts = dict(zip((n for n, _ in profiles), ex.map(lambda p: probe_counts(p[1], start, end, keys, self._log, self.stop_evt), profiles)))
+        d = http_stats() - s0
+        lat_list = d["json_sn"] / d["json_n"] if d["json_n"] else float(hist.get("json", 0.5)); lat_xml = float(hist.get("xml") or 2 * lat_list)
+        with self._merge_lock:
+            self._open_sales = {r[0] for r in self.rows if r[0] in self.force_imeis_set and not r[14]}
+            unresolved = {"in": sum(1 for r in self.rows if r[0] in self.force_imeis_set and not r[5]), "out": len(self._open_sales)}
+        skip = self.supplier_stats.skip_rate(self.settings) if self.tk_skip_learning.get() else 0.0
+        plan = make_scan_plan(counts, order, len(self.docnos_filter), skip, unresolved, int(self.settings.get("fetch_workers", DEFAULTS["fetch_workers"])), lat_list, lat_xml)
+        plan["gp"] = (len(gp_urls), sum(map(gp_is_cached, gp_urls)))
+        text = format_scan_plan(plan, len(profiles) > 1) + f"\nAlışı bilinmeyen IMEI: {unresolved['in']}, satışı bilinmeyen: {unresolved['out']}"
+        self._log("📐 " + text.replace("\n", "\n   "))
+        if self.settings.get("plan_confirm", True) and not messagebox.askyesno("Tarama Planı", text + "\n\nTarama başlatılsın mı?"): return None
+        return plan
+    def _log_plan_actual(self, plan: Dict[str,Any], s0: Counter, t0: float, queued_jobs: Optional[int]=None):
+        """queued_jobs: kuyruk modunda XML'i işçi süreçleri indirir → gerçek sayı kuyruktaki biten+hatalı işlerdir."""
+        d = http_stats() - s0; xml = d["xml_n"] if queued_jobs is None else queued_jobs
+        self._log(f"📐 Tahmin ↔ Gerçek: liste istek {plan['list_req']} ↔ {d['json_n']}, XML {plan['xml_req']} ↔ {xml}{' (kuyruk işleri)' if queued_jobs is not None else ''}, süre ~{plan['seconds']:.0f} ↔ {time.time() - t0:.0f} sn")
+        hist = _read_json(PLAN_STATS_FILE) or {}
+        for k in (("json", "xml") if queued_jobs is None else ("json",)):
+            if d[f"{k}_n"]: hist[k] = d[f"{k}_sn"] / d[f"{k}_n"]
+        try: _write_json(PLAN_STATS_FILE, hist)
+        except OSError as e: self._log(f"❌ Plan istatistiği yazılamadı: {e}")
+    def _scan_nes(self, company: str, token: str, start: str, end: str, multi: bool=False, plan: Optional[Dict[str,Any]]=None):
+        pfx = f"{company} " if multi else ""
+        order = plan["order"] if plan else default_section_order(bool(self.tk_scan_sales.get()), bool(self.docnos_filter))
+        for key in order:
+            if self.stop_evt.is_set(): break
+            if plan and plan["sections"][key]["skip"]: self._log(f"🔸 {pfx}[{PLAN_SECTION_NAMES[key]}] Tüm IMEI'lerin satışı biliniyor → bölüm atlandı."); continue
+            workers = plan["sections"][key]["workers"] if plan else 0
+            if key == "in": self._scan_purchases(company, token, start, end, pfx, workers)
+            else: self._scan_sales(company, token, start, end, pfx, key, workers)
+    def _scan_purchases(self, company: str, token: str, start: str, end: str, pfx: str, workers: int=0):
+        self._log(f"🔹 {pfx}[ALIŞ] Tarama başlıyor...")
+        extra_rows: List[List[Any]] = []; skipped = [0]; no_sid = [0, 0]; idx = 0
+        def wanted(meta: Dict[str,Any]) -> bool:
+            no_sid[0] += 1; no_sid[1] += not meta_supplier_id(meta)
+            if not self._skip_supplier(meta, str(meta.get("id") or "")): return True
+            skipped[0] += 1; return False
+        metas = (m for m in self._iter_list(EINV_IN_LIST, token, start, end, f"{pfx}ALIŞ") if wanted(m))
+        for idx, (meta, P) in enumerate(self._fetch_stream(EINV_IN_DOC, token, metas, workers), 1):
+            inv_id = str(meta.get("id") or ""); doc_no = str(meta.get("documentNumber") or inv_id)
+            if P is None: self._log(f"[{pfx}ALIŞ] {idx}. {doc_no}: XML indirilemedi."); continue
+            self._process_purchase(P, inv_id, doc_no, company, extra_rows)
+        self._log(f"🔹 {pfx}[ALIŞ] İşlenen fatura: {idx}")
+        if skipped[0]: self._log(f"🔹 {pfx}[ALIŞ] IMEI çıkarmadığı öğrenilen tedarikçilerden {skipped[0]} fatura indirilmedi.")
+        self._warn_no_sender(pfx, *no_sid)
+        self._insert_extra_rows(extra_rows)
+    def _iter_list(self, list_url: str, token: str, start: str, end: str, section_name: str) -> Iterator[Dict[str,Any]]:
+        return iter_both_archived(list_url, token, start, end, self._log, self.stop_evt, section_name, prefetch=int(self.settings.get("list_prefetch_pages", DEFAULTS["list_prefetch_pages"])))
+    def _fetch_stream(self, doc_tpl: str, token: str, metas, workers: int=0) -> Iterator[Tuple[Dict[str,Any], Optional[Parsed]]]:
+        def fetch(meta: Dict[str,Any]) -> Optional[Parsed]:
+            xmlb = fetch_xml_by(doc_tpl, token, str(meta.get("id") or ""))
+            return parse_invoice_xml(xmlb) if xmlb else None
+        return pipeline_map(fetch, metas, workers or int(self.settings.get("fetch_workers", DEFAULTS["fetch_workers"])), self.stop_evt)
+    def _warn_no_sender(self, pfx: str, listed: int, missing: int):
+        if self.tk_skip_learning.get() and listed and missing == listed:
+            self._log(f"⚠️ {pfx}[ALIŞ] Liste kayıtlarında gönderen VKN/TCKN alanı bulunamadı ({', '.join(_META_PARTY_KEYS[:2])}…) → öğrenilmiş atlama bu taramada uygulanamadı.")
+    def _skip_supplier(self, meta: Dict[str,Any], inv_id: str) -> bool:
+        return bool(self.tk_skip_learning.get()) and self.supplier_stats.should_skip(meta_supplier_id(meta), inv_id, self.settings)
+    def _insert_extra_rows(self, extra_rows: List[List[Any]]):
+        with self._merge_lock:
+            for r in extra_rows: self._insert_row(r)
+    def _scan_nes_queued(self, profiles: List[Tuple[str,str]], start: str, end: str, queue_db: str, plans: Optional[Dict[str,Dict[str,Any]]]=None) -> int:
+        """Kuyruğa alınan işlerden biten+hatalı olanların sayısını döndürür (XML indirme denemesi)."""
+        q = JobQueue(queue_db); run_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        multi = len(profiles) > 1; default_order = default_section_order(bool(self.tk_scan_sales.get()), bool(self.docnos_filter))
+        procs = spawn_local_workers(queue_db, int(self.tk_queue_workers.get() or 0), dict(profiles))
+        self._log(f"🗂 [KUYRUK] Çalışma {run_id} → {queue_db} (yerel işçi: {len(procs)})")
+        def attempts() -> int:
+            c = q.counts(run_id); return c.get("done", 0) + c.get("failed", 0)
+        try:
+            total = 0
+            for company, token in profiles:
+                pfx = f"{company} " if multi else ""; P_c = (plans or {}).get(company) or {}
+                order = [k for k in (P_c.get("order") or default_order) if not P_c.get("sections", {}).get(k, {}).get("skip")]
+                lists = {"in": (EINV_IN_LIST, "ALIŞ"), "arch": (EARCH_OUT_LIST, "SATIŞ-eArşiv"), "out": (EINV_OUT_LIST, "SATIŞ-Giden")}
+                sections = [(k, *lists[k]) for key in order for k in (("arch", "out") if key == "docnos" else (key,))]
+                targeted = "docnos" in order; located = {}
+                for section, list_url, sec in sections:
+                    if self.stop_evt.is_set(): return attempts()
+                    if section != "in" and targeted:
+                        if not located: located = locate_sales_docnos(token, self.docnos_filter, start, end, self._log, self.stop_evt, pfx)
+                        chunks = [located[section]]
+                    else: chunks = batched(self._iter_list(list_url, token, start, end, f"{pfx}{sec}"), PAGE_SIZE)
+                    n = dropped = listed = missing = 0
+                    for metas in chunks: # sayfa geldikçe kuyruğa → işçiler listeleme bitmeden başlar
+                        if section == "in":
+                            listed += len(metas); missing += sum(1 for m in metas if not meta_supplier_id(m))
+                            n0 = len(metas); metas = [m for m in metas if not self._skip_supplier(m, str(m.get("id") or ""))]; dropped += n0 - len(metas)
+                        n += q.enqueue(run_id, company, section, metas)
+                    if dropped: self._log(f"[KUYRUK] {pfx}{sec}: öğrenilmiş atlama listesiyle {dropped} fatura kuyruğa alınmadı.")
+                    if section == "in": self._warn_no_sender(pfx, listed, missing)
+                    total += n; self._log(f"[KUYRUK] {pfx}{sec}: {n} iş eklendi.")
+            self._log(f"[KUYRUK] Toplam {total} iş kuyrukta; işçiler bekleniyor...")
+            last = None; progress_at = time.time()
+            while not self.stop_evt.is_set():
+                c = q.counts(run_id); open_jobs = c.get("pending", 0) + c.get("claimed", 0)
+                if (c.get("done", 0), c.get("failed", 0), c.get("pending", 0)) != last:
+                    last = (c.get("done", 0), c.get("failed", 0), c.get("pending", 0)); progress_at = time.time()
+                    self._log(f"[KUYRUK] Biten={last[0]} Hatalı={last[1]} Bekleyen={open_jobs}")
+                if not open_jobs: break
+                idle = time.time() - progress_at
+                if procs and all(pr.poll() is not None for pr in procs) and idle >= QUEUE_ORPHAN_SEC:
+                    self._log(f"⚠️ [KUYRUK] Yerel işçilerin tümü çıktı ve {int(idle)} sn'dir ilerleme yok; {open_jobs} iş tamamlanmadan bekleme bırakıldı."); break
+                if idle >= QUEUE_STALL_SEC:
+                    self._log(f"⚠️ [KUYRUK] {int(idle)} sn'dir ilerleme yok (çalışan işçi yok mu?); {open_jobs} iş tamamlanmadan bekleme bırakıldı."); break
+                self.stop_evt.wait(2.0)
+            extra_rows: List[List[Any]] = []; applied = 0
+            for company, section, inv_id, doc_no, P in q.results(run_id):
+                if P is None: continue
+                if section == "in": self._process_purchase(P, inv_id, doc_no, company, extra_rows)
+                else: self._process_sale(P, inv_id, doc_no, QUEUE_KIND[section], company)
+                applied += 1
+            self._insert_extra_rows(extra_rows)
+            self._log(f"[KUYRUK] {applied} sonuç rapora işlendi.")
+            return attempts()
+        finally:
+            for pr in procs:
+                if pr.poll() is None: pr.terminate()
+    def _scan_sales(self, company: str, token: str, start: str, end: str, pfx: str, key: str, workers: int=0):
+        ends = {"arch": (EARCH_OUT_LIST, EARCH_OUT_DOC, "E-ARŞİV", "SATIŞ-eArşiv"), "out": (EINV_OUT_LIST, EINV_OUT_DOC, "E-FATURA", "SATIŞ-Giden")}
+        if key == "docnos":
+            self._log(f"🔸 {pfx}[SATIŞ-HEDEFLİ] EAR/EFR listesi yüklü → yalnız listedeki satışlar aranıyor.")
+            located = locate_sales_docnos(token, self.docnos_filter, start, end, self._log, self.stop_evt, pfx)
+            streams = [(ends[k][1], ends[k][2], located[k]) for k in ("arch", "out")]
+        else:
+            list_url, doc_tpl, kind, sec = ends[key]
+            self._log(f"🔸 {pfx}[{sec}] Tarama başlıyor...")
+            streams = [(doc_tpl, kind, self._iter_list(list_url, token, start, end, f"{pfx}{sec}"))]
+        for doc_tpl, kind, metas in streams:
+            for meta, P in self._fetch_stream(doc_tpl, token, metas, workers):
+                if P is not None:
+                    inv_id = str(meta.get("id") or ""); self._process_sale(P, inv_id, str(meta.get("documentNumber") or "") or inv_id, kind, company)
+                if self._open_sales is not None and not self._open_sales:
+                    self._log(f"🔸 {pfx}[SATIŞ] Tüm IMEI'lerin satışı bulundu → kalan satış faturaları indirilmeyecek."); return
+    def _process_purchase(self, P: Parsed, inv_id: str, doc_no: str, company: str, extra_rows: List[List[Any]]):
+        tU = P.text_upper; is_ref_row = not P.imeis and bool(KEY_REF.search(tU)); is_service_row = not P.imeis and "CEP TELEFONU YENİLEME HİZMETİ" in tU
+        self.supplier_stats.record(P.supplier_id, P.supplier_name, inv_id, bool(P.imeis) or is_ref_row or is_service_row)
+        if not P.imeis and is_whitelisted_supplier(P.supplier_name, self.settings): return
+        if self.tk_unvan.get().strip() and (nlow(self.tk_unvan.get()) not in nlow(P.supplier_name)): return
+        if self.tk_tckn.get().strip() and P.supplier_id != self.tk_tckn.get().strip(): return
+        if self.tk_vkn.get().strip() and P.supplier_id != self.tk_vkn.get().strip(): return
+        with self._merge_lock:
+            for im in P.imeis:
+                if im not in self.force_imeis_set: continue
+                unit_price = ""; line_total = ""; model = P.model; brand = P.brand
+                L = P.imei_lines.get(im)
+                if L is not None: unit_price = L.get("unit_price","") or ""; line_total = L.get("line_total","") or ""; model = L["blob"]; brand = L["brand"]
+                borc_tutar = unit_price or line_total or P.payable
+                self._append_or_merge_purchase(P, inv_id, P.invoice_no or doc_no, im, borc_tutar, model, brand, company=company)
+        if not P.imeis:
+            if is_ref_row: extra_rows.append(ensure_len(["","XML",P.supplier_id,"FATURA",P.issue_date,P.invoice_no or doc_no,P.supplier_name, P.payable, brand_from_text(tU), P.model or "", "","","","","","","", "YENİLENMİŞ ürün (IMEI yok)","Fatura","Satılabilir", "","","","", company]))
+            if is_service_row: extra_rows.append(ensure_len(["", "XML", P.supplier_id, "FATURA (Hizmet)", P.issue_date, P.invoice_no or doc_no, P.supplier_name, P.payable, brand_from_text(tU), P.model or "", "", "", "", "", "", "", "", P.description or "CEP TELEFONU YENİLEME HİZMETİ", "Fatura (Hizmet)", "ALIŞ KAYDI GEREKLİ", "", "", "", "Yenileme Faturası, GP'den eşleştirilmeli", company ]))
+    def _process_sale(self, P: Parsed, inv_id: str, doc_no: str, kind: str, company: str):
+        if not P.imeis: return
+        with self._merge_lock:
+            for im in P.imeis: self._append_or_merge_sale(P, inv_id, P.invoice_no or doc_no, im, kind=kind, company=company)
+            if self._open_sales: self._open_sales.difference_update(P.imeis)
     def _download_selected(self):
         sel = self.tree.selection()
         if not sel: messagebox.showinfo("Bilgi", "Listeden en az bir satır seçin."); return
-        token = self.tk_token.get().strip()
-        if not token: messagebox.showwarning("Uyarı", "Önce token girin."); return
+        profiles = self._token_profiles(); tokens = dict(profiles)
+        if not profiles: messagebox.showwarning("Uyarı", "Önce token girin."); return
+        token = profiles[0][1]
         want_pdf = self.tk_get_pdf.get(); want_xml = self.tk_get_xml.get()
         if not (want_pdf or want_xml): messagebox.showinfo("Bilgi", "PDF ve/veya XML işaretleyin."); return
         save_dir = self.tk_dir.get().strip() or os.getcwd(); os.makedirs(save_dir, exist_ok=True); saved = 0
         for iid in sel:
             ids = self.iid_to_ids.get(iid, {}); in_id = ids.get("in_id"); in_doc = safe_filename(ids.get("in_doc","ALIS")); out_id = ids.get("out_id"); out_doc = safe_filename(ids.get("out_doc","SATIS")); out_kind= ids.get("out_kind","E-ARŞİV")
+            in_tok = tokens.get(ids.get("in_co"), token); out_tok = tokens.get(ids.get("out_co"), token)
             if in_id:
-                if want_xml and (xmlb := fetch_xml_by(EINV_IN_DOC, token, in_id)):
+                if want_xml and (xmlb := fetch_xml_by(EINV_IN_DOC, in_tok, in_id)):
                     with open(os.path.join(save_dir, f"{in_doc}_ALIS.xml"), "wb") as f: f.write(xmlb); saved += 1
-                if want_pdf and (pdfb := fetch_pdf_by(EINV_IN_DOC, token, in_id)):
+                if want_pdf and (pdfb := fetch_pdf_by(EINV_IN_DOC, in_tok, in_id)):
                     with open(os.path.join(save_dir, f"{in_doc}_ALIS.pdf"), "wb") as f: f.write(pdfb); saved += 1
             if out_id:
                 DOC = EARCH_OUT_DOC if out_kind=="E-ARŞİV" else EINV_OUT_DOC
-                if want_xml and (xmlb := fetch_xml_by(DOC, token, out_id)):
+                if want_xml and (xmlb := fetch_xml_by(DOC, out_tok, out_id)):
                     with open(os.path.join(save_dir, f"{out_doc}_SATIS.xml"), "wb") as f: f.write(xmlb); saved += 1
-                if want_pdf and (pdfb := fetch_pdf_by(DOC, token, out_id)):
+                if want_pdf and (pdfb := fetch_pdf_by(DOC, out_tok, out_id)):
                     with open(os.path.join(save_dir, f"{out_doc}_SATIS.pdf"), "wb") as f: f.write(pdfb); saved += 1
         self._log(f"📦 İndirme tamamlandı. Kaydedilen dosya: {saved}")
         if saved:
@@ -952,14 +1877,27 @@ class App(tk.Tk):
         if not rows: messagebox.showinfo("Bilgi", "Henüz sonuç yok."); return
         p = filedialog.asksaveasfilename(title="Excel kaydet", defaultextension=".xlsx", initialfile=os.path.basename(self.settings.get("out_name", DEFAULTS["out_name"])), filetypes=[("Excel", "*.xlsx")])
         if not p: return
-        try: write_excel(rows, p); self._log(f"🧾 Excel yazıldı: {p}")
+        try: write_excel(rows, p, self.summary); self._log(f"🧾 Excel yazıldı: {p}")
         except Exception as e: messagebox.showerror("Hata", f"Excel yazılamadı: {e}")
-    def _append_or_merge_purchase(self, P: Parsed, inv_id: str, doc_no: str, imei: str, payable: str, model: str, brand: str):
+    def _show_summary(self):
+        win = tk.Toplevel(self); win.title("Rapor Özeti"); win.geometry("760x520")
+        tv = ttk.Treeview(win, columns=SUMMARY_HEADERS, show="headings")
+        for c, w in zip(SUMMARY_HEADERS, (90, 260, 80, 140, 140)): tv.heading(c, text=c); tv.column(c, width=w, anchor="e" if c in ("Adet", "Alış Toplamı", "Satış Toplamı") else "w")
+        def refresh():
+            tv.delete(*tv.get_children())
+            for dim, k, n, buy, sell in self.summary.table(): tv.insert("", "end", values=(dim, k, n, f"{buy:,.2f}", f"{sell:,.2f}"))
+        ttk.Button(win, text="Yenile", command=refresh).pack(anchor="w", padx=8, pady=4)
+        tv.pack(fill="both", expand=True, padx=8, pady=4); refresh()
+    def _add_company(self, vals: List[Any], company: str):
+        if not company: return
+        if not vals[24]: vals[24] = company
+        elif company not in vals[24].split(", "): vals[24] += ", " + company
+    def _append_or_merge_purchase(self, P: Parsed, inv_id: str, doc_no: str, imei: str, payable: str, model: str, brand: str, company: str=""):
         if imei not in self.force_imeis_set: return # Sadece ana listedeki IMEI'leri işle
-        pair = (imei, doc_no)
+        pair = (imei, doc_no, company)
         if pair in self.seen_in_pairs: return
         self.seen_in_pairs.add(pair)
-        self._mark_flags(imei, ref=bool(KEY_REF.search(P.text_upper)), is2=bool(KEY_2EL.search(P.text_upper)))
+        self._mark_flags(imei, ref=P.is_ref, is2=P.is_2el)
         self._add_kdv_in(imei, self._find_kdv_for_imei(P, imei))
         iid = self.imei_to_iid.get(imei)
         if iid:
@@ -976,18 +1914,17 @@ class App(tk.Tk):
             elif not vals[18]: vals[18] = "Fatura"
             vals[1] = "XML" if not vals[1] or vals[1]=="Bulunamadı" else vals[1]
             if vals[19] == "ALIŞ KAYDI GEREKLİ": vals[19] = "Satılabilir"
-            self.tree.item(iid, values=vals)
-            idx = self.iid_to_row_index.get(iid)
-            if idx is not None: self.rows[idx] = ensure_len(vals)
+            self._add_company(vals, company)
+            self._set_row(iid, vals)
             ids = self.iid_to_ids.setdefault(iid, {})
-            if not ids.get("in_id"): ids["in_id"] = inv_id; ids["in_doc"] = doc_no
+            if not ids.get("in_id"): ids["in_id"] = inv_id; ids["in_doc"] = doc_no; ids["in_co"] = company
             self._update_kdv_cols(imei); self._update_classification_for(imei)
-    def _append_or_merge_sale(self, P: Parsed, inv_id: str, doc_no: str, imei: str, kind: str):
+    def _append_or_merge_sale(self, P: Parsed, inv_id: str, doc_no: str, imei: str, kind: str, company: str=""):
         if imei not in self.force_imeis_set: return # Sadece ana listedeki IMEI'leri işle
-        pair = (imei, doc_no)
+        pair = (imei, doc_no, company)
         if pair in self.seen_out_pairs: return
         self.seen_out_pairs.add(pair)
-        self._mark_flags(imei, ref=bool(KEY_REF.search(P.text_upper)), is2=bool(KEY_2EL.search(P.text_upper)))
+        self._mark_flags(imei, ref=P.is_ref, is2=P.is_2el)
         self._add_kdv_out(imei, self._find_kdv_for_imei(P, imei))
         iid = self.imei_to_iid.get(imei)
         if iid:
@@ -1000,12 +1937,33 @@ class App(tk.Tk):
             if not vals[15]: vals[15] = P.buyer_id_type
             if not vals[16]: vals[16] = P.buyer_id
             vals[19] = "Satılmış"
-            self.tree.item(iid, values=vals)
-            idx = self.iid_to_row_index.get(iid)
-            if idx is not None: self.rows[idx] = ensure_len(vals)
+            self._add_company(vals, company)
+            self._set_row(iid, vals)
             ids = self.iid_to_ids.setdefault(iid, {})
-            if not ids.get("out_id"): ids["out_id"] = inv_id; ids["out_doc"] = doc_no; ids["out_kind"] = kind
+            if not ids.get("out_id"): ids["out_id"] = inv_id; ids["out_doc"] = doc_no; ids["out_kind"] = kind; ids["out_co"] = company
             self._update_kdv_cols(imei); self._update_classification_for(imei)
 
-if __name__ == "__main__":
+def main(argv: List[str]) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="IMEI → Alış + Satış Birleşik Rapor")
+    ap.add_argument("--worker", metavar="KUYRUK_DB", help="Arayüz açmadan paylaşımlı kuyruktan iş işleyen işçi olarak çalış")
+    ap.add_argument("--worker-id", default="")
+    ap.add_argument("--idle-exit", type=float, default=0, help="İş kalmadığında bu kadar saniye sonra çık (0 = sürekli bekle)")
+    ap.add_argument("--profile", metavar="CIKTI_ON_EKI", help="Arayüzsüz çalışmayı profille; <ön ek>_profil.folded/.pstats ve <ön ek>_bellek.txt yazılır")
+    ap.add_argument("--serve", action="store_true", help="Tarama sonuçlarından IMEI sorgu servisi (HTTP/JSON) başlat")
+    ap.add_argument("--host", default="127.0.0.1"); ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--store", default=REPORT_DB, help="Sorgu deposu (SQLite)")
+    args = ap.parse_args(argv)
+    log = lambda m: print(m, flush=True)
+    if args.serve:
+        serve_imei_lookup(args.host, args.port, args.store, log)
+        return 0
+    if args.worker:
+        with (profile_scan(args.profile, log) if args.profile else contextlib.nullcontext()):
+            run_queue_worker(args.worker, worker_token_profiles(load_settings()), log, threading.Event(), args.worker_id, args.idle_exit)
+        return 0
     App().mainloop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Sıcak fonksiyonlar için mikro-benchmark / gerileme kontrolü.
+
+Sentetik bir derlem (küçük fatura, IMEI yoğun toptan fatura, büyük ekli fatura, serbest ve şablon
+GP çalışma kitapları) üretir; parse_invoice_xml, extract_imeis/_luhn_ok_imei, brand_from_text,
+parse_gp_workbook, parse_gp_template_workbook ve write_excel'i birkaç veri boyutunda ölçer.
+
+  python bench_hot_paths.py --save-baseline      # bu makinedeki sonuçları taban olarak kaydet
+  python bench_hot_paths.py                       # tabana göre karşılaştır; gerileme varsa çıkış kodu 1, taban yoksa 2
+  python bench_hot_paths.py --filter gp --quick   # yalnızca adında "gp" geçenler, az tekrar
+
+Her ölçüm için ≥0,25 sn'lik örneklerin medyan süresinden işlem hızı (birim/sn), örnekler arası yayılım (3·MAD) ve
+ayrı bir çalıştırmada tracemalloc tepe belleği tutulur. Hız tabanın (1 - eşik - gürültü) katından düşük ya da tepe bellek
+(1 + eşik) katından ve MEM_FLOOR_MB'den fazla yüksekse gerileme sayılır; gürültü, bu çalıştırmanın ve tabanın yayılımının
+büyüğüdür (en fazla NOISE_CAP). Gerileme görünen ölçüm bir kez daha ölçülür, ikisinde de gerilemişse başarısız sayılır.
+"""
+
+import gc, os, io, sys, json, math, time, base64, random, argparse, importlib, statistics, tempfile, tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+G = importlib.import_module("GiderpusulasıV4")
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+MIN_SAMPLE_SEC = 0.25  # tek örnek en az bu kadar sürsün (kısa çağrılar döngüde)
+MEM_FLOOR_MB   = 0.25  # bunun altındaki tepe bellek farkları gürültü sayılır
+NOISE_CAP      = 0.20  # gürültü payı en fazla bu kadar eklenir (2 kat yavaşlama her durumda yakalansın)
+MODELS = ["APPLE IPHONE 13 128GB", "SAMSUNG GALAXY A54 8/256", "XIAOMI REDMI NOTE 12", "HUAWEI P30 LITE", "HONOR 90",
+          "OPPO A78", "REALME C55", "TECNO SPARK 10", "GENERAL MOBILE GM 23", "KILIF + EKRAN KORUYUCU", "ŞARJ ADAPTÖRÜ 20W"]
+
+# ====================== Sentetik derlem ======================
+def _imei(n: int) -> str:
+    base = f"{35000000000000 + n:014d}"
+    for d in "0123456789":
+        if G._luhn_ok_imei(base + d): return base + d
+    raise ValueError(base)
+
+def make_invoice(lines: int, imei_lines: int, attachment_kb: int = 0, seed: int = 0) -> bytes:
+    rnd = random.Random(seed); out = []
+    for i in range(lines):
+        model = rnd.choice(MODELS)
+        name = f"{model} IMEI: {_imei(seed * 100000 + i)}" if i < imei_lines else model
+        out.append(f"""<cac:InvoiceLine><cbc:ID>{i+1}</cbc:ID><cbc:InvoicedQuantity unitCode="C62">1</cbc:InvoicedQuantity>
+<cbc:LineExtensionAmount currencyID="TRY">{1000 + i}.00</cbc:LineExtensionAmount>
+<cac:TaxTotal><cbc:TaxAmount currencyID="TRY">{(1000 + i) * 0.2:.2f}</cbc:TaxAmount><cac:TaxSubtotal><cbc:Percent>{rnd.choice((1, 20))}</cbc:Percent></cac:TaxSubtotal></cac:TaxTotal>
+<cac:Item><cbc:Description>{"YENİLENMİŞ" if i % 7 == 0 else "SIFIR"}</cbc:Description><cbc:Name>{name}</cbc:Name></cac:Item>
+<cac:Price><cbc:PriceAmount currencyID="TRY">{1000 + i}.00</cbc:PriceAmount></cac:Price></cac:InvoiceLine>""")
+    attach = ""
+    if attachment_kb:
+        blob = base64.b64encode(rnd.randbytes(attachment_kb * 768)).decode("ascii")
+        attach = f"""<cac:AdditionalDocumentReference><cbc:ID>PDF</cbc:ID><cac:Attachment>
+<cbc:EmbeddedDocumentBinaryObject mimeCode="application/pdf" filename="fatura.pdf">{blob}</cbc:EmbeddedDocumentBinaryObject></cac:Attachment></cac:AdditionalDocumentReference>"""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+<cbc:ID>EFR2024{seed:09d}</cbc:ID><cbc:IssueDate>2024-03-01</cbc:IssueDate><cbc:Note>Sentetik fatura</cbc:Note>{attach}
+<cac:AccountingSupplierParty><cac:Party><cac:PartyIdentification><cbc:ID schemeID="VKN">1234567890</cbc:ID></cac:PartyIdentification><cac:PartyName><cbc:Name>TOPTANCI A.Ş.</cbc:Name></cac:PartyName></cac:Party></cac:AccountingSupplierParty>
+<cac:AccountingCustomerParty><cac:Party><cac:PartyIdentification><cbc:ID schemeID="TCKN">12345678901</cbc:ID></cac:PartyIdentification><cac:Person><cbc:FirstName>Ali</cbc:FirstName><cbc:FamilyName>Veli</cbc:FamilyName></cac:Person></cac:Party></cac:AccountingCustomerParty>
+<cac:TaxTotal><cbc:TaxAmount currencyID="TRY">200.00</cbc:TaxAmount></cac:TaxTotal>
+<cac:LegalMonetaryTotal><cbc:PayableAmount currencyID="TRY">1200.00</cbc:PayableAmount></cac:LegalMonetaryTotal>
+{"".join(out)}</Invoice>""".encode("utf-8")
+
+def make_gp_workbook(rows: int, template: bool, sheets: int = 1):
+    from openpyxl import Workbook
+    wb = Workbook(); wb.remove(wb.active); rnd = random.Random(rows)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Şube{s+1}")
+        if template: ws.append(["imei", "Tck/Vkn", "Belge Türü", "Belge Tarihi", "Belge No", "Alınan Kişi", "Borç Tutar", "Marka", "MODEL"])
+        else: ws.append(["İşlem Tarihi", "IMEI / Seri", "Ödenen Tutar", "Satıcı Adı", "Şube", "Açıklama"])
+        for i in range(rows):
+            im = _imei(s * 1000000 + i); model = rnd.choice(MODELS) + (" 2.EL" if i % 3 == 0 else "")
+            if template: ws.append([im, "12345678901", "GMA", "2024-01-02", f"GP{i}", "Ahmet Yılmaz", 5000 + i, "", model])
+            else: ws.append(["2024-01-02", im, 5000 + i, "Ahmet Yılmaz", "Merkez", model])
+    return wb
+
+def make_report_rows(n: int) -> List[List[Any]]:
+    rnd = random.Random(n)
+    return [G.ensure_len([_imei(i), "XML", "1234567890", "FATURA", "2024-03-01", f"EFR2024{i:09d}", "TOPTANCI A.Ş.", "1000.00",
+                          "APPLE", rnd.choice(MODELS), "2024-04-01", "Ali Veli", "1500.00", "250.00", f"EAR2024{i:09d}", "TCKN", "12345678901",
+                          "", "Fatura", "Satılmış", "20", "1", "YENİLENMİŞ", "SATIŞ KDV=1", "ANA"]) for i in range(n)]
+
+# ====================== Ölçüm ======================
+def _quiet(_msg: str): pass
+
+def cases(quick: bool, tmp_dir: str) -> List[Tuple[str, int, Callable[[], Callable[[], Any]]]]:
+    """(ad, birim sayısı, hazırlık) – hazırlık ölçülmez ve ölçülecek çağrıyı döndürür. Yazılan dosyalar tmp_dir altına gider."""
+    def inv(lines, imeis, kb=0):
+        def setup():
+            b = make_invoice(lines, imeis, kb)
+            return lambda: G.parse_invoice_xml(b)
+        return setup
+    def text_of(n):
+        def setup():
+            rnd = random.Random(n)
+            t = " | ".join(f"{rnd.choice(MODELS)} {_imei(i) if i % 2 else rnd.randrange(10**9, 10**12)}" for i in range(n))
+            return lambda: G.extract_imeis(t)
+        return setup
+    def luhn(n):
+        def setup():
+            vals = [f"{35000000000000 + i:014d}{i % 10}" for i in range(n)]
+            return lambda: [G._luhn_ok_imei(v) for v in vals]
+        return setup
+    def brand(n):
+        def setup():
+            vals = [MODELS[i % len(MODELS)] + f" {i}" for i in range(n)]
+            return lambda: [G.brand_from_text(v) for v in vals]
+        return setup
+    def gp(n, template):
+        def setup():
+            wb = make_gp_workbook(n, template)
+            fn = G.parse_gp_template_workbook if template else G.parse_gp_workbook
+            return lambda: fn(wb, _quiet)
+        return setup
+    def xlsx(n):
+        def setup():
+            rows = make_report_rows(n); path = os.path.join(tmp_dir, f"rapor_{n}.xlsx")
+            return lambda: G.write_excel(rows, path)
+        return setup
+    small = [200, 1000] if quick else [1000, 5000]
+    out = [
+        ("parse_invoice_xml/kucuk", 1, inv(3, 0)),
+        ("parse_invoice_xml/toptan_100", 100, inv(100, 100)),
+        ("parse_invoice_xml/toptan_500", 500, inv(500, 500)),
+        ("parse_invoice_xml/ekli_2MB", 1, inv(5, 1, 2048)),
+    ]
+    out += [(f"extract_imeis/{n}", n, text_of(n)) for n in small]
+    out += [(f"luhn_ok_imei/{n}", n, luhn(n)) for n in (10000, 100000)]
+    out += [(f"brand_from_text/{n}", n, brand(n)) for n in small]
+    out += [(f"parse_gp_workbook/{n}", n, gp(n, False)) for n in small]
+    out += [(f"parse_gp_template_workbook/{n}", n, gp(n, True)) for n in small]
+    out += [(f"write_excel/{n}", n, xlsx(n)) for n in small]
+    return out
+
+def measure(fn: Callable[[], Any], repeat: int, min_sample: float = MIN_SAMPLE_SEC) -> Tuple[float, float, float]:
+    """(çağrı başına medyan süre sn, göreli yayılım 3·MAD/medyan, tepe bellek MB). Ölçüm sırasında GC kapalıdır."""
+    fn()  # ısınma (derlenen regex'ler, import'lar)
+    t0 = time.perf_counter(); fn(); one = time.perf_counter() - t0
+    number = max(1, math.ceil(min_sample / one)) if one > 0 else 1
+    samples = []; gc.collect(); gc_was = gc.isenabled(); gc.disable()
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for _ in range(number): fn()
+            samples.append((time.perf_counter() - t0) / number)
+    finally:
+        if gc_was: gc.enable()
+    med = statistics.median(samples)
+    tracemalloc.start(); fn(); _, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    mad = statistics.median(abs(x - med) for x in samples)
+    return med, 3 * mad / med if med else 0.0, peak / 1048576
+
+def regressed(r: Dict[str, float], b: Dict[str, float], threshold: float) -> Tuple[bool, str]:
+    dt = r["throughput"] / b["throughput"] - 1; dm = (r["peak_mb"] / b["peak_mb"] - 1) if b["peak_mb"] else 0.0
+    noise = min(NOISE_CAP, max(r.get("spread", 0.0), b.get("spread", 0.0)))
+    slow = dt < -(threshold + noise); fat = dm > threshold and r["peak_mb"] - b["peak_mb"] > MEM_FLOOR_MB
+    return slow or fat, f"hız {dt:+.0%} (gürültü ±{noise:.0%}), bellek {dm:+.0%}"
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="Sıcak fonksiyon mikro-benchmark'ları")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--save-baseline", action="store_true", help="Sonuçları taban olarak yaz (karşılaştırma yapma)")
+    ap.add_argument("--threshold", type=float, default=0.25, help="İzin verilen gerileme oranı (varsayılan 0.25)")
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--filter", default="", help="Yalnızca adında bu metin geçen ölçümler")
+    ap.add_argument("--quick", action="store_true", help="Küçük boyutlar ve 5 tekrar")
+    args = ap.parse_args(argv)
+    repeat = 5 if args.quick else args.repeat
+    base = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f: base = json.load(f).get("results", {})
+    results: Dict[str, Dict[str, float]] = {}; failed = []
+    print(f"{'ölçüm':40} {'süre ms':>10} {'birim/sn':>14} {'tepe MB':>9}  taban karşılaştırması")
+    with tempfile.TemporaryDirectory(prefix="gp_bench_") as tmp_dir:
+        for name, units, setup in cases(args.quick, tmp_dir):
+            if args.filter and args.filter not in name: continue
+            fn = setup(); note = ""
+            for attempt in range(2):
+                secs, spread, peak = measure(fn, repeat)
+                r = results[name] = {"seconds": secs, "throughput": units / secs if secs else float("inf"), "spread": spread, "peak_mb": peak}
+                if name not in base: break
+                bad, note = regressed(r, base[name], args.threshold)
+                if not bad: break
+            else: failed.append(name); note += "  ← GERİLEME"
+            print(f"{name:40} {secs*1000:10.2f} {r['throughput']:14.0f} {peak:9.2f}  {note}")
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "saved": time.strftime("%Y-%m-%d %H:%M"), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Taban kaydedildi: {args.baseline}")
+        return 0
+    if not base:
+        print(f"Taban bulunamadı ({args.baseline}); önce --save-baseline ile oluşturun.")
+        return 2
+    if failed:
+        print(f"{len(failed)} ölçümde gerileme: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))